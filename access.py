@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+from typing import Dict, FrozenSet, Optional
+
+from dotenv import dotenv_values
+from telegram import Update
+
+from flood import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ENV_FILE = os.getenv("ENV_FILE", ".env")
+USER_RATE = float(os.getenv("USER_RATE", "1"))
+USER_BURST = float(os.getenv("USER_BURST", "50"))
+THROTTLE_NOTICE_INTERVAL = float(os.getenv("THROTTLE_NOTICE_INTERVAL", "30"))
+ACCESS_RELOAD_INTERVAL = 10.0
+
+THROTTLE_NOTICE = "⏳ You're sending too fast, some messages were skipped. Please slow down."
+
+
+def parse_user_ids(value: Optional[str]) -> FrozenSet[int]:
+    ids = set()
+    for part in (value or "").replace(",", " ").split():
+        try:
+            ids.add(int(part))
+        except ValueError:
+            logger.warning(f"Ignoring invalid user id in ALLOWED_USER_IDS: {part!r}")
+    return frozenset(ids)
+
+
+def _allowed_user_ids(env_file: str) -> FrozenSet[int]:
+    values = dotenv_values(env_file) if os.path.exists(env_file) else {}
+    return parse_user_ids(values.get("ALLOWED_USER_IDS", os.getenv("ALLOWED_USER_IDS")))
+
+
+def _is_upload(update: Update) -> bool:
+    message = update.effective_message
+    return message is not None and (message.video is not None or message.document is not None)
+
+
+class AccessGate:
+    """Admits or drops updates before any handler runs.
+
+    Users outside ``ALLOWED_USER_IDS`` (when the list is non-empty) are dropped
+    silently. Allowed users each get a token bucket of ``rate`` updates per
+    second with ``burst`` capacity; updates beyond it are dropped and the user
+    gets one notice per ``notice_interval``. Updates replayed from a backlog
+    are admitted with ``throttle=False``: they arrive at processing speed, not
+    at the speed the user sent them. Videos and documents are not throttled
+    either: a dump of episodes is the bot's main use, and their outbound cost
+    is bounded by the flood limiter. The allow list is re-read from
+    ``env_file`` on SIGHUP and when the file changes.
+    """
+
+    def __init__(self, env_file: str = ENV_FILE, rate: float = USER_RATE, burst: float = USER_BURST,
+                 notice_interval: float = THROTTLE_NOTICE_INTERVAL):
+        self.env_file = env_file
+        self.rate = rate
+        self.burst = burst
+        self.notice_interval = notice_interval
+        self.allowed: FrozenSet[int] = _allowed_user_ids(env_file)
+        self._mtime = self._env_mtime()
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._noticed: Dict[int, float] = {}
+        self._prune_at = 1024
+        self._notices = set()
+        self._watcher: Optional[asyncio.Task] = None
+        self.rejected = 0
+        self.throttled = 0
+        self.reloads = 0
+
+    def _env_mtime(self) -> float:
+        try:
+            return os.stat(self.env_file).st_mtime
+        except OSError:
+            return 0.0
+
+    def reload(self):
+        allowed = _allowed_user_ids(self.env_file)
+        if allowed != self.allowed:
+            logger.info(f"ALLOWED_USER_IDS reloaded: {len(allowed) or 'all'} users allowed")
+        self.allowed = allowed
+        self.reloads += 1
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+        self._watcher = loop.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(ACCESS_RELOAD_INTERVAL)
+            mtime = self._env_mtime()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self.reload()
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                for key in [key for key, b in self._buckets.items() if b.idle]:
+                    del self._buckets[key]
+                self._prune_at = max(1024, 2 * len(self._buckets))
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def admit(self, update: object, throttle: bool = True) -> bool:
+        """Synchronous so it doesn't reorder a user's updates; notices are sent in the background."""
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            return True
+        if self.allowed and user.id not in self.allowed:
+            self.rejected += 1
+            return False
+        if not throttle or self.rate <= 0 or _is_upload(update) or self._bucket(user.id).try_acquire():
+            return True
+        self.throttled += 1
+        now = time.monotonic()
+        if now - self._noticed.get(user.id, -self.notice_interval) >= self.notice_interval:
+            self._noticed[user.id] = now
+            task = asyncio.create_task(self._notify(update))
+            self._notices.add(task)
+            task.add_done_callback(self._notices.discard)
+        return False
+
+    async def _notify(self, update: Update):
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(THROTTLE_NOTICE)
+            elif update.effective_message is not None:
+                await update.effective_message.reply_text(THROTTLE_NOTICE)
+        except Exception as e:
+            logger.warning(f"Throttle notice to {update.effective_user.id} failed: {e}")
+        if len(self._noticed) > self._prune_at:
+            cutoff = time.monotonic() - self.notice_interval
+            self._noticed = {uid: at for uid, at in self._noticed.items() if at >= cutoff}
+
+    def stats(self) -> dict:
+        return {
+            "allowed_users": len(self.allowed),
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+            "tracked_users": len(self._buckets),
+            "reloads": self.reloads,
+        }
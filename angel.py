@@ -1,9 +1,13 @@
+import asyncio
+import contextlib
+import functools
 import logging
 import os
-import re
-import requests
+import secrets
+import signal
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Chat, ChatMember, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaVideo
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -14,82 +18,115 @@ from telegram.ext import (
     ConversationHandler,
 )
 
+# the modules below read their settings from the environment at import time
+load_dotenv()
+
+from access import AccessGate
+from batching import QueuedVideo, VideoBatcher
+from captions import render_caption, renderers
+from catchup import STARTUP_BACKLOG, CatchUp
+from edits import MessageEditor
+from flood import GLOBAL_RATE, FloodControlLimiter, retry_after_seconds
+from http_client import FetchError, ImageFetcher
+from images import ImageError, ImageNormalizer
+from jobs import SendJob, SendJobQueue, job_key
+import logs
+from loop_monitor import monitor as loop_monitor
+from metrics import InstrumentedRequest, registry, timed
+from persistence import SQLitePersistence
+from scheduler import OrderedUpdateProcessor
+from shards import WORKERS, HashRing, ShardConsumer, ShardRouter, WorkerPool
+from thumb_cache import ThumbCache, content_hash
+from urls import image_urls
+from user_settings import UserSettings
+from web import WebServer
+
 # -------------------------
 # Setup
 # -------------------------
-load_dotenv()
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("thumbnail_bot_ptb.log"),
-        logging.StreamHandler()
-    ]
-)
+logs.setup_logging()
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+PORT = int(os.getenv("PORT", "8000"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# a public webhook always checks a secret, or anyone reaching PORT could post forged updates;
+# without WEBHOOK_SECRET each run registers a random one
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "") or (secrets.token_urlsafe(32) if WEBHOOK_URL else "")
+# polling mode: the bot process serves the app.py routes (/health, /metrics) on the public port
+METRICS_PORT = int(os.getenv("METRICS_PORT", str(PORT)))
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+MAX_DESTINATIONS = int(os.getenv("MAX_DESTINATIONS", "10"))
+POLL_TIMEOUT = 10
+ROUTE_RETRY_MAX = 30.0
 
 SETTINGS_MENU, PREFIX_INPUT, SUFFIX_INPUT, LINK_INPUT, MENTION_INPUT = range(5)
 
-URL_PATTERN = re.compile(
-    r'https?://(?:[a-zA-Z0-9$-_@.&+!*\'(),]|(?:%[0-9a-fA-F]{2}))+'
-    r'\.(?:jpg|jpeg|png|webp|bmp)(?:\?.*)?$',
-    re.IGNORECASE
-)
-
-VIDEO_EXTENSIONS = ("mkv", "mp4", "avi", "mov", "webm", "m4v", "flv")
+image_fetcher = ImageFetcher()
+image_normalizer = ImageNormalizer()
+thumb_cache = ThumbCache()
+access_gate = AccessGate()
+catch_up = CatchUp()
+message_editor = MessageEditor()
+send_jobs = SendJobQueue()
 
 
 # -------------------------
-# Helper functions
+# Build Settings Pages
 # -------------------------
-def insert_suffix_before_extension(filename: str, suffix_text: str) -> str:
-    if not suffix_text:
-        return filename
-    m = re.search(r'\.([A-Za-z0-9]{1,5})$', filename)
-    if m:
-        ext = m.group(1)
-        if ext.lower() in VIDEO_EXTENSIONS:
-            base = filename[:m.start()]
-            return f"{base} {suffix_text}.{ext}"
-    return f"{filename} {suffix_text}"
-
-
-def escape_html(text: str) -> str:
-    return (
-        text.replace("&", "&amp;")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-    )
-
+# Keyboards never depend on user settings, so they are built once and shared.
+PAGE1_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("𝐁𝐨𝐥𝐝", callback_data="style:bold"),
+     InlineKeyboardButton("𝘐𝘵𝘢𝘭𝘪𝘤", callback_data="style:italic")],
+    [InlineKeyboardButton("𝙼𝚘𝚗𝚘𝚜𝚙𝚊𝚌𝚎", callback_data="style:monospace"),
+     InlineKeyboardButton("Underline", callback_data="style:underline")],
+    [InlineKeyboardButton("Strikethrough", callback_data="style:strikethrough"),
+     InlineKeyboardButton("Spoiler", callback_data="style:spoiler")],
+    [InlineKeyboardButton("Next ➡️", callback_data="nav:page2"),
+     InlineKeyboardButton("🗑 Clear Style", callback_data="style:none")],
+    [InlineKeyboardButton("✅ Done", callback_data="style:done")]
+])
+
+PAGE2_TEXT = """
+⚙️ <b>Settings — Page 2 / 3</b>
 
-def apply_style_to_text(text: str, style: str) -> str:
-    if not text:
-        return text
-    if style == "blockquote":
-        return f"<blockquote>{escape_html(text)}</blockquote>"
-    if style == "pre":
-        return f"<pre>{escape_html(text)}</pre>"
-    if style == "bold":
-        return f"<b>{escape_html(text)}</b>"
-    if style == "italic":
-        return f"<i>{escape_html(text)}</i>"
-    if style == "monospace":
-        return f"<code>{escape_html(text)}</code>"
-    if style == "underline":
-        return f"<u>{escape_html(text)}</u>"
-    if style == "strikethrough":
-        return f"<s>{escape_html(text)}</s>"
-    if style == "spoiler":
-        return f"<tg-spoiler>{escape_html(text)}</tg-spoiler>"
-    return escape_html(text)
+<b>Extra formats:</b>
+"""
+PAGE2_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❝ Blockquote", callback_data="style:blockquote"),
+     InlineKeyboardButton("⤷ Pre (code block)", callback_data="style:pre")],
+    [InlineKeyboardButton("⬅️ Back", callback_data="nav:page1"),
+     InlineKeyboardButton("Next ➡️", callback_data="nav:page3")],
+    [InlineKeyboardButton("✅ Done", callback_data="style:done")]
+])
+
+PAGE3_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Set Prefix", callback_data="set:prefix"),
+     InlineKeyboardButton("Set Suffix", callback_data="set:suffix")],
+    [InlineKeyboardButton("Set Link Wrap", callback_data="set:link"),
+     InlineKeyboardButton("Set Mention", callback_data="set:mention")],
+    [InlineKeyboardButton("🗑 Clear Prefix", callback_data="clear:prefix"),
+     InlineKeyboardButton("🗑 Clear Suffix", callback_data="clear:suffix")],
+    [InlineKeyboardButton("🗑 Clear Link", callback_data="clear:link"),
+     InlineKeyboardButton("🗑 Clear Mention", callback_data="clear:mention")],
+    [InlineKeyboardButton("🧹 Clear All Settings", callback_data="confirm:clear_all")],
+    [InlineKeyboardButton("🪄 Preview Caption", callback_data="action:preview")],
+    [InlineKeyboardButton("⬅️ Back", callback_data="nav:page2"),
+     InlineKeyboardButton("✅ Done", callback_data="style:done")]
+])
+
+CONFIRM_CLEAR_ALL_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Yes, Clear All", callback_data="clear:all"),
+     InlineKeyboardButton("❌ No, Cancel", callback_data="cancel:clear_all")]
+])
+CONFIRM_CLEAR_ALL_CMD_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Yes, Clear All", callback_data="clear:all_cmd"),
+     InlineKeyboardButton("❌ No, Cancel", callback_data="cancel:clear_all_cmd")]
+])
 
 
-# -------------------------
-# Build Settings Pages
-# -------------------------
 def build_settings_page(user_data: dict, page: int = 1) -> (str, InlineKeyboardMarkup):
     caption_style = user_data.get("caption_style", "none")
     prefix = user_data.get("prefix", "")
@@ -109,33 +146,10 @@ def build_settings_page(user_data: dict, page: int = 1) -> (str, InlineKeyboardM
 
 <b>Choose a basic caption style:</b>
 """
-        keyboard = [
-            [InlineKeyboardButton("𝐁𝐨𝐥𝐝", callback_data="style:bold"),
-             InlineKeyboardButton("𝘐𝘵𝘢𝘭𝘪𝘤", callback_data="style:italic")],
-            [InlineKeyboardButton("𝙼𝚘𝚗𝚘𝚜𝚙𝚊𝚌𝚎", callback_data="style:monospace"),
-             InlineKeyboardButton("Underline", callback_data="style:underline")],
-            [InlineKeyboardButton("Strikethrough", callback_data="style:strikethrough"),
-             InlineKeyboardButton("Spoiler", callback_data="style:spoiler")],
-            [InlineKeyboardButton("Next ➡️", callback_data="nav:page2"),
-             InlineKeyboardButton("🗑 Clear Style", callback_data="style:none")],
-            [InlineKeyboardButton("✅ Done", callback_data="style:done")]
-        ]
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, PAGE1_KEYBOARD
 
     elif page == 2:
-        text = """
-⚙️ <b>Settings — Page 2 / 3</b>
-
-<b>Extra formats:</b>
-"""
-        keyboard = [
-            [InlineKeyboardButton("❝ Blockquote", callback_data="style:blockquote"),
-             InlineKeyboardButton("⤷ Pre (code block)", callback_data="style:pre")],
-            [InlineKeyboardButton("⬅️ Back", callback_data="nav:page1"),
-             InlineKeyboardButton("Next ➡️", callback_data="nav:page3")],
-            [InlineKeyboardButton("✅ Done", callback_data="style:done")]
-        ]
-        return text, InlineKeyboardMarkup(keyboard)
+        return PAGE2_TEXT, PAGE2_KEYBOARD
 
     else:
         text = f"""
@@ -146,21 +160,7 @@ def build_settings_page(user_data: dict, page: int = 1) -> (str, InlineKeyboardM
 <b>Link wrap:</b> <code>{link_wrap or '-'}</code>
 <b>Mention text:</b> <code>{mention_text or '-'}</code>
 """
-        keyboard = [
-            [InlineKeyboardButton("Set Prefix", callback_data="set:prefix"),
-             InlineKeyboardButton("Set Suffix", callback_data="set:suffix")],
-            [InlineKeyboardButton("Set Link Wrap", callback_data="set:link"),
-             InlineKeyboardButton("Set Mention", callback_data="set:mention")],
-            [InlineKeyboardButton("🗑 Clear Prefix", callback_data="clear:prefix"),
-             InlineKeyboardButton("🗑 Clear Suffix", callback_data="clear:suffix")],
-            [InlineKeyboardButton("🗑 Clear Link", callback_data="clear:link"),
-             InlineKeyboardButton("🗑 Clear Mention", callback_data="clear:mention")],
-            [InlineKeyboardButton("🧹 Clear All Settings", callback_data="confirm:clear_all")],
-            [InlineKeyboardButton("🪄 Preview Caption", callback_data="action:preview")],
-            [InlineKeyboardButton("⬅️ Back", callback_data="nav:page2"),
-             InlineKeyboardButton("✅ Done", callback_data="style:done")]
-        ]
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, PAGE3_KEYBOARD
 
 
 # -------------------------
@@ -182,6 +182,9 @@ I can change video thumbnails/covers and style captions.
 /clear_link - Remove link wrapping
 /clear_mention - Remove mention text
 /clear_everything - 🧹 Clear all saved settings at once
+/add_dest &lt;@channel|chat id|here&gt; - Send videos to a chat you admin instead of here
+/remove_dest &lt;@channel|title|chat id|here&gt; - Stop sending videos there
+/dests - List destinations
 """
     await update.message.reply_text(text, parse_mode='HTML')
 
@@ -207,13 +210,9 @@ async def clear_mention_command(update: Update, context: ContextTypes.DEFAULT_TY
 
 
 async def clear_everything_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [InlineKeyboardButton("✅ Yes, Clear All", callback_data="clear:all_cmd"),
-         InlineKeyboardButton("❌ No, Cancel", callback_data="cancel:clear_all_cmd")]
-    ]
     await update.message.reply_text(
         "⚠️ Are you sure you want to clear ALL your saved settings?",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=CONFIRM_CLEAR_ALL_CMD_KEYBOARD,
         parse_mode='HTML'
     )
 
@@ -222,21 +221,20 @@ async def clear_everything_command(update: Update, context: ContextTypes.DEFAULT
 # Settings Handler
 # -------------------------
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ud = context.user_data
-    ud.setdefault('caption_style', 'none')
-    ud.setdefault('prefix', '')
-    ud.setdefault('suffix', '')
-    ud.setdefault('mention_text', '')
-    ud.setdefault('link_wrap', None)
-
-    text, markup = build_settings_page(ud, page=1)
-    await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    text, markup = build_settings_page(context.user_data, page=1)
+    msg = await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    message_editor.remember(msg, text, markup, 'HTML')
     return SETTINGS_MENU
 
 
+@timed("settings_button_handler")
 async def settings_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
+    try:
+        await query.answer()
+    except BadRequest as e:
+        # taps replayed from a catch-up backlog are too old to answer; still apply them
+        logger.info(f"Could not answer callback query: {e}")
     data = query.data or ""
     user_data = context.user_data
 
@@ -244,19 +242,19 @@ async def settings_button_handler(update: Update, context: ContextTypes.DEFAULT_
     if data.startswith("nav:"):
         page = int(data[-1])
         text, markup = build_settings_page(user_data, page=page)
-        await query.edit_message_text(text, reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, text, reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Style
     if data.startswith("style:"):
         style = data.split(":", 1)[1]
         if style == "done":
-            await query.edit_message_text("✅ <b>Settings saved!</b>", parse_mode='HTML')
+            await message_editor.edit(query, "✅ <b>Settings saved!</b>", parse_mode='HTML')
             return ConversationHandler.END
         user_data['caption_style'] = style
         text, markup = build_settings_page(user_data, page=1)
-        await query.edit_message_text(f"✅ Style set to <code>{style}</code>\n\n{text}",
-                                      reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, f"✅ Style set to <code>{style}</code>\n\n{text}",
+                                  reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Set inputs
@@ -268,46 +266,42 @@ async def settings_button_handler(update: Update, context: ContextTypes.DEFAULT_
             "link": "🔗 Send the URL to wrap your captions.",
             "mention": "💬 Send your custom Mention text (like 'Join my channel - @fjiffyuv')."
         }
-        await query.edit_message_text(prompts[which])
+        await message_editor.edit(query, prompts[which])
         return {"prefix": PREFIX_INPUT, "suffix": SUFFIX_INPUT, "link": LINK_INPUT, "mention": MENTION_INPUT}[which]
 
     # Clear prefix
     if data == "clear:prefix":
         user_data.pop("prefix", None)
         text, markup = build_settings_page(user_data, page=3)
-        await query.edit_message_text("✅ Prefix cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, "✅ Prefix cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Clear suffix
     if data == "clear:suffix":
         user_data.pop("suffix", None)
         text, markup = build_settings_page(user_data, page=3)
-        await query.edit_message_text("✅ Suffix cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, "✅ Suffix cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Clear link
     if data == "clear:link":
         user_data.pop("link_wrap", None)
         text, markup = build_settings_page(user_data, page=3)
-        await query.edit_message_text("✅ Link wrap cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, "✅ Link wrap cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Clear mention
     if data == "clear:mention":
         user_data.pop("mention_text", None)
         text, markup = build_settings_page(user_data, page=3)
-        await query.edit_message_text("✅ Mention text cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, "✅ Mention text cleared!\n\n" + text, reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Confirm before clear all from button
     if data == "confirm:clear_all":
-        keyboard = [
-            [InlineKeyboardButton("✅ Yes, Clear All", callback_data="clear:all"),
-             InlineKeyboardButton("❌ No, Cancel", callback_data="cancel:clear_all")]
-        ]
-        await query.edit_message_text("⚠️ Are you sure you want to clear all saved settings?",
-                                      reply_markup=InlineKeyboardMarkup(keyboard),
-                                      parse_mode='HTML')
+        await message_editor.edit(query, "⚠️ Are you sure you want to clear all saved settings?",
+                                  reply_markup=CONFIRM_CLEAR_ALL_KEYBOARD,
+                                  parse_mode='HTML')
         return SETTINGS_MENU
 
     # Clear all confirmed (button version)
@@ -315,47 +309,34 @@ async def settings_button_handler(update: Update, context: ContextTypes.DEFAULT_
         for key in ["prefix", "suffix", "mention_text", "link_wrap", "caption_style"]:
             user_data.pop(key, None)
         text, markup = build_settings_page(user_data, page=3)
-        await query.edit_message_text("🧹 All settings cleared!\n\n" + text,
-                                      reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, "🧹 All settings cleared!\n\n" + text,
+                                  reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Cancel clear all (button version)
     if data == "cancel:clear_all":
         text, markup = build_settings_page(user_data, page=3)
-        await query.edit_message_text("❌ Clear all cancelled.\n\n" + text,
-                                      reply_markup=markup, parse_mode='HTML')
+        await message_editor.edit(query, "❌ Clear all cancelled.\n\n" + text,
+                                  reply_markup=markup, parse_mode='HTML')
         return SETTINGS_MENU
 
     # Clear all confirmed (command version)
     if data == "clear:all_cmd":
         for key in ["prefix", "suffix", "mention_text", "link_wrap", "caption_style"]:
             user_data.pop(key, None)
-        await query.edit_message_text("🧹 All settings cleared successfully!",
-                                      parse_mode='HTML')
+        await message_editor.edit(query, "🧹 All settings cleared successfully!",
+                                  parse_mode='HTML')
         return SETTINGS_MENU
 
     # Cancel clear all (command version)
     if data == "cancel:clear_all_cmd":
-        await query.edit_message_text("❌ Clear all cancelled.", parse_mode='HTML')
+        await message_editor.edit(query, "❌ Clear all cancelled.", parse_mode='HTML')
         return SETTINGS_MENU
 
     # Preview
     if data.startswith("action:preview"):
         sample = "🔥 The Summer Hikaru Died S01 Ep 07 - 12 [Hindi-English-Japanese] 1080p HEVC 10bit WEB-DL ESub ~ Aᴍɪᴛ ~ [TW4ALL].mkv"
-        prefix = user_data.get('prefix', '')
-        suffix = user_data.get('suffix', '')
-        style = user_data.get('caption_style', 'none')
-        mention_text = user_data.get('mention_text', '')
-        link_wrap = user_data.get('link_wrap')
-
-        composed = f"{prefix} {sample}".strip()
-        composed = insert_suffix_before_extension(composed, suffix)
-        if mention_text:
-            composed += f"\n\n{mention_text}"
-        styled = apply_style_to_text(composed, style)
-        if link_wrap:
-            styled = f'<a href="{escape_html(link_wrap)}">{styled}</a>'
-
+        styled = render_caption(user_data, sample)
         await query.message.reply_text(f"🪄 <b>Preview:</b>\n{styled}", parse_mode='HTML')
         return SETTINGS_MENU
 
@@ -369,7 +350,8 @@ async def prefix_input_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data['prefix'] = update.message.text.strip()
     await update.message.reply_text("✅ Prefix updated.")
     text, markup = build_settings_page(context.user_data, page=3)
-    await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    msg = await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    message_editor.remember(msg, text, markup, 'HTML')
     return SETTINGS_MENU
 
 
@@ -377,7 +359,8 @@ async def suffix_input_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data['suffix'] = update.message.text.strip()
     await update.message.reply_text("✅ Suffix updated.")
     text, markup = build_settings_page(context.user_data, page=3)
-    await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    msg = await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    message_editor.remember(msg, text, markup, 'HTML')
     return SETTINGS_MENU
 
 
@@ -385,7 +368,8 @@ async def link_input_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['link_wrap'] = update.message.text.strip()
     await update.message.reply_text("✅ Link wrap URL saved!")
     text, markup = build_settings_page(context.user_data, page=3)
-    await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    msg = await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    message_editor.remember(msg, text, markup, 'HTML')
     return SETTINGS_MENU
 
 
@@ -393,7 +377,8 @@ async def mention_input_handler(update: Update, context: ContextTypes.DEFAULT_TY
     context.user_data['mention_text'] = update.message.text.strip()
     await update.message.reply_text("✅ Mention text saved!")
     text, markup = build_settings_page(context.user_data, page=3)
-    await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    msg = await update.message.reply_text(text, reply_markup=markup, parse_mode='HTML')
+    message_editor.remember(msg, text, markup, 'HTML')
     return SETTINGS_MENU
 
 
@@ -402,6 +387,108 @@ async def cancel_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+# -------------------------
+# Destinations
+# -------------------------
+async def resolve_destination(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Returns the chat named by the command argument, or None after telling the user why not."""
+    if not context.args:
+        await update.message.reply_text("Usage: /add_dest @channel, /add_dest -100123456789 or /add_dest here")
+        return None
+    target = context.args[0]
+    if target.lower() == "here":
+        return update.effective_chat
+    if target.lstrip("-").isdigit():
+        target = int(target)
+    elif not target.startswith("@"):
+        target = "@" + target
+    try:
+        return await context.bot.get_chat(target)
+    except TelegramError as e:
+        await update.message.reply_text(f"❌ Can't find {target}: {e.message}. Add me to the chat first.")
+        return None
+
+
+async def add_destination_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = await resolve_destination(update, context)
+    if chat is None:
+        return
+    destinations = context.user_data.setdefault("destinations", [])
+    if any(dest["id"] == chat.id for dest in destinations):
+        await update.message.reply_text("ℹ️ Already a destination.")
+        return
+    if len(destinations) >= MAX_DESTINATIONS:
+        await update.message.reply_text(f"❌ You can have at most {MAX_DESTINATIONS} destinations.")
+        return
+    if chat.id != update.effective_user.id:
+        # don't let the bot be used to post into chats the user doesn't run
+        try:
+            member = await context.bot.get_chat_member(chat.id, update.effective_user.id)
+            me = await context.bot.get_chat_member(chat.id, context.bot.id)
+        except TelegramError as e:
+            await update.message.reply_text(f"❌ Can't check the chat's admins: {e.message}")
+            return
+        if member.status not in (ChatMember.OWNER, ChatMember.ADMINISTRATOR):
+            await update.message.reply_text("❌ Only admins of a chat can add it as a destination.")
+            return
+        if chat.type == Chat.CHANNEL and me.status != ChatMember.ADMINISTRATOR:
+            await update.message.reply_text("❌ Make me an admin of the channel so I can post there.")
+            return
+        if me.status in (ChatMember.LEFT, ChatMember.BANNED):
+            await update.message.reply_text("❌ Add me to the chat first.")
+            return
+    title = chat.title or chat.username or chat.full_name or str(chat.id)
+    destination = {"id": chat.id, "title": title}
+    if chat.username:
+        destination["username"] = chat.username
+    destinations.append(destination)
+    await update.message.reply_text(f"✅ Videos will be sent to {title}. "
+                                    f"Use /add_dest here to keep getting them in this chat too.")
+
+
+def destination_matches(dest: dict, target: str) -> bool:
+    """Whether ``target`` is the destination's id, @username (the @ is optional) or title."""
+    target = target.casefold()
+    names = {str(dest["id"]), dest["title"].casefold()}
+    if dest.get("username"):
+        names.add(dest["username"].casefold())
+    return target in names or (target.startswith("@") and target[1:] in names)
+
+
+async def remove_destination_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    destinations = context.user_data.get("destinations", [])
+    target = " ".join(context.args or ())
+    if target.lower() == "here":
+        target = str(update.effective_chat.id)
+    kept = [dest for dest in destinations if not destination_matches(dest, target)]
+    if target and len(kept) == len(destinations) and not target.lstrip("-").isdigit() and " " not in target:
+        # destinations added before usernames were stored: look the name up
+        try:
+            chat = await context.bot.get_chat(target if target.startswith("@") else "@" + target)
+        except TelegramError:
+            chat = None
+        if chat is not None:
+            kept = [dest for dest in destinations if dest["id"] != chat.id]
+    if not target or len(kept) == len(destinations):
+        await update.message.reply_text("Usage: /remove_dest followed by a chat from /dests")
+        return
+    if kept:
+        context.user_data["destinations"] = kept
+    else:
+        context.user_data.pop("destinations", None)
+    await update.message.reply_text("✅ Destination removed.")
+
+
+async def list_destinations_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    destinations = context.user_data.get("destinations", [])
+    if not destinations:
+        await update.message.reply_text("📭 No destinations; videos are sent back to you.")
+        return
+    lines = [f"• {dest['title']} (@{dest['username']}, {dest['id']})" if dest.get("username")
+             else f"• {dest['title']} ({dest['id']})" for dest in destinations]
+    await update.message.reply_text("📬 Videos are sent to:\n" + "\n".join(lines))
+
+
 # -------------------------
 # Thumbnail / Video Handlers
 # -------------------------
@@ -418,65 +505,191 @@ async def clear_thumb_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text("✅ Thumbnail cleared.")
 
 
+@timed("save_thumb")
 async def save_thumb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["thumb_file_id"] = update.message.photo[-1].file_id
     await update.message.reply_text("✅ Thumbnail saved!")
 
 
+async def thumb_from_url(update: Update, url: str):
+    file_id = thumb_cache.get_by_url(url)
+    if file_id:
+        return file_id
+    try:
+        content = await image_fetcher.fetch_image(url)
+        digest = content_hash(content)
+        file_id = thumb_cache.get_by_content(digest)
+        if file_id is None:
+            content = await image_normalizer.normalize(content, digest)
+            msg = await update.message.reply_photo(photo=content, caption="🖼️ Image fetched.")
+            file_id = msg.photo[-1].file_id
+        thumb_cache.put(file_id, url=url, digest=digest)
+        return file_id
+    except (FetchError, ImageError) as e:
+        logger.warning(f"URL thumbnail fetch failed for {url}: {e}")
+    except Exception:
+        logger.exception(f"URL thumbnail failed for {url}")
+    return None
+
+
+@timed("handle_url_thumb")
 async def handle_url_thumb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    url = update.message.text.strip()
-    if URL_PATTERN.match(url):
-        try:
-            res = requests.get(url, timeout=10)
-            res.raise_for_status()
-            msg = await update.message.reply_photo(photo=res.content, caption="🖼️ Image fetched.")
-            context.user_data["thumb_file_id"] = msg.photo[-1].file_id
+    urls = image_urls(update.message)
+    if not urls:
+        return
+    # the first URL that yields an image becomes the thumbnail
+    for url in urls:
+        file_id = await thumb_from_url(update, url)
+        if file_id:
+            context.user_data["thumb_file_id"] = file_id
             await update.message.reply_text("✅ Thumbnail saved from URL!")
-        except Exception:
-            await update.message.reply_text("❌ Failed to download image.")
+            return
+    await update.message.reply_text("❌ Failed to download image.")
 
 
+@timed("send_video")
 async def send_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     thumb = context.user_data.get("thumb_file_id")
     if not thumb:
         await update.message.reply_text("⚠️ Please send a thumbnail first.")
         return
 
-    video_file_id = update.message.video.file_id if update.message.video else update.message.document.file_id
-    ud = context.user_data
-    prefix, suffix = ud.get('prefix', ''), ud.get('suffix', '')
-    caption_style = ud.get('caption_style', 'none')
-    mention_text = ud.get('mention_text', '')
-    link_wrap = ud.get('link_wrap', None)
+    video = update.message.video or update.message.document
+    # rendered once, whatever the number of destinations
+    final_caption = render_caption(context.user_data, update.message.caption or "")
+    destinations = tuple(dest["id"] for dest in context.user_data.get("destinations", ()))
+    item = QueuedVideo(update.message.message_id, video.file_id, final_caption, thumb,
+                       job_key(video.file_unique_id, final_caption, thumb))
+
+    # recorded before sending, so a crash or a failed send is retried rather than lost
+    send_now, repeats = await send_jobs.enqueue(
+        item,
+        user_id=update.effective_user.id,
+        chat_id=update.message.chat_id,
+        media_group_id=update.message.media_group_id,
+        destinations=destinations or (update.message.chat_id,),
+    )
+    if repeats and not send_now:
+        await update.message.reply_text("⏳ This video is already waiting to be sent with these settings.")
+    if not send_now:
+        return
+    video_batcher.add(
+        context.bot,
+        chat_id=update.message.chat_id,
+        user_id=update.effective_user.id,
+        media_group_id=update.message.media_group_id,
+        item=item,
+        destinations=send_now,
+    )
 
-    caption = update.message.caption or ""
-    composed = f"{prefix} {caption}".strip()
-    composed = insert_suffix_before_extension(composed, suffix)
-    if mention_text:
-        composed += f"\n\n{mention_text}"
 
-    final_caption = apply_style_to_text(composed, caption_style)
-    if link_wrap:
-        final_caption = f'<a href="{escape_html(link_wrap)}">{final_caption}</a>'
+def resend_job(bot, job: SendJob):
+    video_batcher.add(bot, chat_id=job.chat_id, user_id=job.user_id, media_group_id=job.media_group_id,
+                      item=job.item, destinations=(job.destination,))
 
-    await context.bot.send_video(
-        chat_id=update.message.chat_id,
-        video=video_file_id,
-        caption=final_caption,
-        cover=thumb,
-        parse_mode='HTML'
-    )
+
+def job_owner(shard):
+    # the send job file is shared; each shard worker resumes the jobs of its own users
+    if shard is None:
+        return None
+    ring = HashRing(WORKERS)
+    return lambda user_id: ring.shard_for(user_id) == shard
+
+
+def prepare_video_chunk(items):
+    # built once per chunk and reused for every destination
+    if len(items) == 1:
+        return items[0]
+    return [
+        InputMediaVideo(media=item.file_id, caption=item.caption, cover=item.cover, parse_mode='HTML')
+        for item in items
+    ]
+
+
+async def send_video_chunk(bot, chat_id: int, chunk):
+    if isinstance(chunk, QueuedVideo):
+        await bot.send_video(
+            chat_id=chat_id,
+            video=chunk.file_id,
+            caption=chunk.caption,
+            cover=chunk.cover,
+            parse_mode='HTML'
+        )
+        return
+    await bot.send_media_group(chat_id=chat_id, media=chunk)
+
+
+video_batcher = VideoBatcher(send_video_chunk, prepare=prepare_video_chunk, on_result=send_jobs.on_result)
 
 
 # -------------------------
 # Main
 # -------------------------
-def main():
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN missing.")
-        return
-
-    app = Application.builder().token(BOT_TOKEN).build()
+async def on_startup(app: Application):
+    loop_monitor.start()
+    access_gate.start()
+    app.persistence.start_eviction(app, busy=app.update_processor.user_busy)
+    await image_fetcher.start()
+    image_normalizer.start()
+    # polling mode: serve the app.py routes (incl. /metrics) from this process;
+    # shard workers get their own port
+    metrics_port = app.bot_data.get("metrics_port", METRICS_PORT if BOT_MODE != "webhook" else 0)
+    if metrics_port:
+        from app import app as flask_app
+        server = app.bot_data["http_server"] = WebServer(flask_app, port=metrics_port)
+        await server.start()
+    send_jobs.start(functools.partial(resend_job, app.bot), owns=job_owner(app.bot_data.get("shard")))
+    if app.bot_data.get("catch_up"):
+        # polling mode: before polling starts, so the backlog runs ahead of new updates
+        await catch_up.run(app)
+
+
+async def on_stop(app: Application):
+    await video_batcher.flush_all()
+    logger.info(f"Video batcher stats: {video_batcher.stats()}")
+    await send_jobs.stop()
+    logger.info(f"Send job stats: {send_jobs.stats()}")
+
+
+async def on_shutdown(app: Application):
+    server = app.bot_data.pop("http_server", None)
+    if server is not None:
+        await server.stop()
+    await image_fetcher.close()
+    image_normalizer.close()
+    await access_gate.stop()
+    await loop_monitor.stop()
+    logger.info(f"Thumbnail cache stats: {thumb_cache.stats()}")
+
+
+def api_base_urls(api_url: str) -> dict:
+    # a local Bot API server, or the fake one used by bench/loadtest.py
+    if not api_url:
+        return {}
+    return {"base_url": f"{api_url.rstrip('/')}/bot", "base_file_url": f"{api_url.rstrip('/')}/file/bot"}
+
+
+def build_application(token: str, api_url: str = BOT_API_URL) -> Application:
+    persistence = SQLitePersistence()
+    update_processor = OrderedUpdateProcessor(admit=access_gate.admit)
+    # the global Bot API limit is shared by all shard workers
+    rate_limiter = FloodControlLimiter(global_rate=GLOBAL_RATE / WORKERS)
+    builder = Application.builder().token(token)
+    for option, url in api_base_urls(api_url).items():
+        builder = getattr(builder, option)(url)
+    app = (
+        builder
+        .request(InstrumentedRequest())
+        .get_updates_request(InstrumentedRequest(connection_pool_size=1))
+        .persistence(persistence)
+        .context_types(ContextTypes(user_data=UserSettings))
+        .concurrent_updates(update_processor)
+        .rate_limiter(rate_limiter)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     settings_conv = ConversationHandler(
         entry_points=[CommandHandler("settings", settings_command)],
@@ -500,13 +713,238 @@ def main():
     app.add_handler(CommandHandler("clear_link", clear_link_command))
     app.add_handler(CommandHandler("clear_mention", clear_mention_command))
     app.add_handler(CommandHandler("clear_everything", clear_everything_command))
+    app.add_handler(CommandHandler("add_dest", add_destination_command))
+    app.add_handler(CommandHandler("remove_dest", remove_destination_command))
+    app.add_handler(CommandHandler("dests", list_destinations_command))
 
     app.add_handler(MessageHandler(filters.PHOTO, save_thumb))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_url_thumb))
     app.add_handler(MessageHandler(filters.VIDEO | filters.Document.VIDEO, send_video))
 
+    registry.register_stats("bot_updates", update_processor.stats, counters={"processed", "dropped"})
+    registry.register_stats("bot_catchup", catch_up.stats)
+    registry.register_stats("bot_access", access_gate.stats, counters={"rejected", "throttled", "reloads"})
+    registry.register_stats("bot_thumb_cache", thumb_cache.stats,
+                            counters={"hits", "misses", "evictions", "expirations"})
+    registry.register_stats("bot_image_normalizer", image_normalizer.stats,
+                            counters={"normalized", "deduplicated", "failed", "bytes_in", "bytes_out"})
+    registry.register_stats("bot_caption_renderers", renderers.stats, counters={"hits", "misses"})
+    registry.register_stats("bot_message_edits", message_editor.stats,
+                            counters={"edits", "skipped", "not_modified"})
+    registry.register_stats("bot_video_batcher", video_batcher.stats,
+                            counters={"videos_in", "chunks_out", "destination_failures"})
+    registry.register_stats("bot_send_jobs", send_jobs.stats,
+                            counters={"enqueued", "duplicates", "sent", "retries", "failed", "resumed"})
+    registry.register_stats("bot_flood", rate_limiter.stats,
+                            counters={"global_acquired", "global_delayed", "retry_afters"})
+    registry.register_stats("bot_event_loop", loop_monitor.stats, counters={"stalls"})
+    registry.register_stats("bot_persistence", persistence.stats,
+                            counters={"rows_written", "batches_written", "write_failures", "evicted"})
+    registry.register_stats("bot_logging", logs.stats, counters={"dropped", "sampled_out"})
+    return app
+
+
+def stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+@contextlib.asynccontextmanager
+async def running(app: Application):
+    """The Application lifecycle run_polling() would run, for the other modes."""
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        yield app
+    finally:
+        if app.running:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+async def set_webhook(bot: Bot):
+    if not WEBHOOK_URL:
+        logger.warning(f"WEBHOOK_URL not set; not registering a webhook, POST updates to {WEBHOOK_PATH}"
+                       + ("" if WEBHOOK_SECRET else " (no secret is checked: for local testing only)"))
+        return
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=STARTUP_BACKLOG == "drop",
+        secret_token=WEBHOOK_SECRET or None,
+    )
+
+
+async def run_webhook(app: Application):
+    # imported here so app.py's logging.basicConfig doesn't run before ours
+    from app import app as flask_app
+
+    async def enqueue_update(data: dict):
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+    server = WebServer(
+        flask_app,
+        port=PORT,
+        webhook_path=WEBHOOK_PATH,
+        on_update=enqueue_update,
+        secret_token=WEBHOOK_SECRET or None,
+    )
+    stop = stop_event()
+    async with running(app):
+        await server.start()
+        try:
+            if STARTUP_BACKLOG == "catchup":
+                await catch_up.run(app)
+            await set_webhook(app.bot)
+            logger.info("🚀 Bot is running (webhook)...")
+            await stop.wait()
+        finally:
+            await server.stop()
+
+
+# -------------------------
+# Sharded mode (WORKERS > 1)
+# -------------------------
+async def poll_updates(bot: Bot, route):
+    offset = None
+    retry_in = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES)
+        except RetryAfter as e:
+            await asyncio.sleep(retry_after_seconds(e))
+            continue
+        except TelegramError as e:
+            logger.warning(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        if updates:
+            # confirmed to Telegram (by the next offset) only once durably queued
+            try:
+                await asyncio.gather(*(route(update.to_dict()) for update in updates))
+            except Exception:
+                # e.g. the queue database is locked or the disk is full; fetch the same updates again
+                logger.exception(f"Queueing {len(updates)} updates failed; retrying in {retry_in:.0f}s")
+                await asyncio.sleep(retry_in)
+                retry_in = min(retry_in * 2, ROUTE_RETRY_MAX)
+                continue
+            retry_in = 1.0
+            offset = updates[-1].update_id + 1
+
+
+async def queue_backlog(bot: Bot, route):
+    if STARTUP_BACKLOG != "catchup":
+        await bot.delete_webhook(drop_pending_updates=True)
+        return
+    updates = catch_up.coalesce(await catch_up.fetch(bot))
+    await asyncio.gather(*(route(update.to_dict()) for update in updates))
+    await catch_up.confirm(bot)
+    logger.info(f"Catch-up: queued {len(updates)} backlog updates for the workers")
+
+
+async def run_ingress(token: str, api_url: str = BOT_API_URL):
+    """Receives updates (polling or webhook) and queues them for the shard workers."""
+    from app import app as flask_app
+
+    stop = stop_event()
+    router = ShardRouter()
+    await router.start()
+    pool = WorkerPool(run_worker)
+    registry.register_stats("bot_shards", router.stats, counters={"routed", "batches"})
+    registry.register_stats("bot_workers", pool.stats, counters={"restarts"})
+    registry.register_stats("bot_catchup", catch_up.stats)
+    bot = Bot(token, request=InstrumentedRequest(), get_updates_request=InstrumentedRequest(connection_pool_size=1),
+              **api_base_urls(api_url))
+    server, poller = None, None
+
+    async def tick():
+        if poller is not None and poller.done():
+            # don't keep the workers up with nothing feeding them
+            raise RuntimeError("Update polling stopped") from poller.exception()
+        await router.refresh_depths()
+
+    loop_monitor.start()
+    try:
+        async with bot:
+            if BOT_MODE == "webhook":
+                server = WebServer(flask_app, port=PORT, webhook_path=WEBHOOK_PATH, on_update=router.route,
+                                   secret_token=WEBHOOK_SECRET or None)
+                await server.start()
+                await queue_backlog(bot, router.route)
+                # after the backlog is queued, so workers replay it instead of throttling it
+                pool.start()
+                await set_webhook(bot)
+            else:
+                if METRICS_PORT:
+                    server = WebServer(flask_app, port=METRICS_PORT)
+                    await server.start()
+                await queue_backlog(bot, router.route)
+                pool.start()
+                poller = asyncio.create_task(poll_updates(bot, router.route))
+            logger.info(f"🚀 Ingress is running ({BOT_MODE}, {WORKERS} workers)...")
+            await pool.supervise(stop, on_tick=tick)
+    finally:
+        if poller is not None:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        if server is not None:
+            await server.stop()
+        await pool.stop()
+        await router.close()
+        await loop_monitor.stop()
+
+
+async def consume_shard(app: Application, shard: int):
+    async def process(data: dict, replayed: bool):
+        update = Update.de_json(data, app.bot)
+        if replayed:
+            await app.update_processor.process_replayed(update, app.process_update(update))
+        else:
+            await app.update_processor.process_update(update, app.process_update(update))
+
+    stop = stop_event()
+    consumer = ShardConsumer(shard, process)
+    registry.register_stats("bot_shard", consumer.stats, counters={"received", "acked", "failed"})
+    async with running(app):
+        logger.info(f"🚀 Worker {shard} is running...")
+        await consumer.run(stop)
+
+
+def run_worker(shard: int):
+    """Entry point of a shard worker process."""
+    app = build_application(BOT_TOKEN)
+    app.bot_data["shard"] = shard
+    if METRICS_PORT:
+        app.bot_data["metrics_port"] = METRICS_PORT + 1 + shard
+    asyncio.run(consume_shard(app, shard))
+
+
+def main():
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN missing.")
+        return
+
+    if WORKERS > 1:
+        asyncio.run(run_ingress(BOT_TOKEN))
+        return
+
+    app = build_application(BOT_TOKEN)
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(app))
+        return
+
+    app.bot_data["catch_up"] = STARTUP_BACKLOG == "catchup"
     logger.info("🚀 Bot is running...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=STARTUP_BACKLOG == "drop")
 
 
 if __name__ == "__main__":
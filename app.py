@@ -1,6 +1,9 @@
-from flask import Flask
+from flask import Flask, Response
 import logging
 
+import metrics
+from loop_monitor import monitor
+
 app = Flask(__name__)
 
 # Setup logging
@@ -17,7 +20,20 @@ def ping():
 
 @app.route('/health')
 def health():
+    if not monitor.running:
+        # e.g. run under gunicorn: there's no bot event loop in this process to report on
+        return 'UNKNOWN: not served from the bot process', 503
+    if not monitor.healthy():
+        stats = monitor.stats()
+        return f"UNHEALTHY: event loop lag {stats['lag_seconds']:.3f}s, stalled {stats['stall_seconds']:.3f}s", 503
     return 'OK'
 
+@app.route('/metrics')
+def metrics_endpoint():
+    if not monitor.running:
+        # the metrics live in the bot process; here there would be nothing but HELP/TYPE lines
+        return 'Not found: metrics are served by the bot process', 404
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
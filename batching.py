@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW = float(os.getenv("VIDEO_BATCH_WINDOW", "1.5"))
+BATCH_MAX_WAIT = float(os.getenv("VIDEO_BATCH_MAX_WAIT", "6"))
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "8"))
+MEDIA_GROUP_LIMIT = 10
+
+
+class QueuedVideo(NamedTuple):
+    message_id: int
+    file_id: str
+    caption: str
+    cover: str
+    # identifies the send job(s) for this video; see jobs.job_key
+    key: str = ""
+
+
+class _Batch:
+    __slots__ = ("bot", "chat_id", "destinations", "items", "deadline", "timer")
+
+    def __init__(self, bot, chat_id: int, destinations: Tuple[Union[int, str], ...], deadline: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.destinations = destinations
+        self.items: List[QueuedVideo] = []
+        self.deadline = deadline
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class VideoBatcher:
+    """Collects re-covered videos so bulk forwards go out in as few calls as possible.
+
+    Videos are grouped by ``media_group_id`` (albums come back as albums) or, for
+    standalone videos, per user within ``window`` seconds of each other. A batch
+    is flushed once it is quiet for ``window`` seconds, reaches the album limit,
+    or is ``max_wait`` seconds old. Each chunk of up to ten videos, in message
+    order, is built once with ``prepare(items)`` and sent with
+    ``send_chunk(bot, chat_id, chunk)`` to every destination of the batch (the
+    source chat by default). A batch's destinations are served concurrently, at
+    most ``fanout_concurrency`` of its sends at a time, so other users' batches
+    don't wait on a slow channel, and one failing destination doesn't hold up
+    or repeat the others. ``on_result(bot, chat_id, items, error)`` is awaited
+    after each chunk with the exception it raised, or None.
+    """
+
+    def __init__(self, send_chunk: Callable[..., Awaitable], window: float = BATCH_WINDOW,
+                 max_wait: float = BATCH_MAX_WAIT, prepare: Optional[Callable[[List[QueuedVideo]], Any]] = None,
+                 fanout_concurrency: int = FANOUT_CONCURRENCY, on_result: Optional[Callable[..., Awaitable]] = None):
+        self.send_chunk = send_chunk
+        self.prepare = prepare
+        self.on_result = on_result
+        self.window = window
+        self.max_wait = max_wait
+        self.fanout_concurrency = fanout_concurrency
+        self._batches: Dict[Hashable, _Batch] = {}
+        self._chat_tails: Dict[int, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.videos_in = 0
+        self.chunks_out = 0
+        self.destination_failures = 0
+
+    def add(self, bot, chat_id: int, user_id: int, media_group_id: Optional[str], item: QueuedVideo,
+            destinations: Tuple[Union[int, str], ...] = ()):
+        destinations = destinations or (chat_id,)
+        # a change of destinations starts a new batch
+        if media_group_id:
+            key = ("album", chat_id, media_group_id, destinations)
+        else:
+            key = ("window", chat_id, user_id, destinations)
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(bot, chat_id, destinations, loop.time() + self.max_wait)
+        batch.items.append(item)
+        self.videos_in += 1
+        if batch.timer is not None:
+            batch.timer.cancel()
+        if len(batch.items) >= MEDIA_GROUP_LIMIT:
+            self._flush(key)
+            return
+        delay = max(0.0, min(self.window, batch.deadline - loop.time()))
+        batch.timer = loop.call_later(delay, self._flush, key)
+
+    def _flush(self, key: Hashable):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        previous = self._chat_tails.get(batch.chat_id)
+        task = asyncio.create_task(self._send(batch, previous))
+        self._chat_tails[batch.chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda t, chat_id=batch.chat_id: self._task_done(chat_id, t))
+
+    def _task_done(self, chat_id: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._chat_tails.get(chat_id) is task:
+            del self._chat_tails[chat_id]
+
+    async def _send(self, batch: _Batch, previous: Optional[asyncio.Task]):
+        # keep batches for the same chat in the order they were flushed
+        if previous is not None:
+            await asyncio.wait([previous])
+        items = sorted(batch.items, key=lambda item: item.message_id)
+        chunks = []
+        for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+            chunk = items[start:start + MEDIA_GROUP_LIMIT]
+            chunks.append((chunk, self.prepare(chunk) if self.prepare else chunk))
+        fanout = asyncio.Semaphore(self.fanout_concurrency)
+        await asyncio.gather(*(self._send_to(batch.bot, chat_id, chunks, fanout) for chat_id in batch.destinations))
+
+    async def _send_to(self, bot, chat_id: Union[int, str], chunks: List[Tuple[List[QueuedVideo], Any]],
+                       fanout: asyncio.Semaphore):
+        for items, chunk in chunks:
+            error = None
+            async with fanout:
+                try:
+                    await self.send_chunk(bot, chat_id, chunk)
+                except Exception as e:
+                    error = e
+                    self.destination_failures += 1
+                    logger.exception(f"Failed to send {len(items)} video(s) to chat {chat_id}")
+            self.chunks_out += 1
+            if self.on_result is not None:
+                try:
+                    await self.on_result(bot, chat_id, items, error)
+                except Exception:
+                    logger.exception(f"Recording the result for chat {chat_id} failed")
+
+    async def flush_all(self):
+        for key in list(self._batches):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending_batches": len(self._batches),
+            "videos_in": self.videos_in,
+            "chunks_out": self.chunks_out,
+            "destination_failures": self.destination_failures,
+        }
@@ -0,0 +1,100 @@
+"""Micro-benchmark: compiled CaptionRenderer vs. the previous per-call caption path.
+
+Run from the repository root:  python bench/bench_captions.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captions import render_caption  # noqa: E402
+
+VIDEO_EXTENSIONS = ("mkv", "mp4", "avi", "mov", "webm", "m4v", "flv")
+
+CAPTIONS = [
+    "🔥 The Summer Hikaru Died S01 Ep 07 - 12 [Hindi-English-Japanese] 1080p HEVC 10bit WEB-DL ESub ~ Aᴍɪᴛ ~ [TW4ALL].mkv",
+    "Solo Leveling S02E05 [Dual Audio] 720p x264 WEB-DL & ESubs <Encoded>.mp4",
+    "[SubsPlease] Frieren - 28 (1080p) [A1B2C3D4].mkv",
+    "Movie Night Special – Director's Cut (2024) 2160p HDR.webm",
+]
+
+SETTINGS = {
+    "prefix": "@MyChannel",
+    "suffix": "[HQ]",
+    "caption_style": "bold",
+    "mention_text": "Join my channel - @fjiffyuv",
+    "link_wrap": "https://t.me/fjiffyuv?start=a&b",
+}
+
+
+# the caption path as it was in angel.py before CaptionRenderer
+def insert_suffix_before_extension(filename, suffix_text):
+    if not suffix_text:
+        return filename
+    m = re.search(r'\.([A-Za-z0-9]{1,5})$', filename)
+    if m:
+        ext = m.group(1)
+        if ext.lower() in VIDEO_EXTENSIONS:
+            base = filename[:m.start()]
+            return f"{base} {suffix_text}.{ext}"
+    return f"{filename} {suffix_text}"
+
+
+def escape_html(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def apply_style_to_text(text, style):
+    if not text:
+        return text
+    if style == "blockquote":
+        return f"<blockquote>{escape_html(text)}</blockquote>"
+    if style == "pre":
+        return f"<pre>{escape_html(text)}</pre>"
+    if style == "bold":
+        return f"<b>{escape_html(text)}</b>"
+    if style == "italic":
+        return f"<i>{escape_html(text)}</i>"
+    if style == "monospace":
+        return f"<code>{escape_html(text)}</code>"
+    if style == "underline":
+        return f"<u>{escape_html(text)}</u>"
+    if style == "strikethrough":
+        return f"<s>{escape_html(text)}</s>"
+    if style == "spoiler":
+        return f"<tg-spoiler>{escape_html(text)}</tg-spoiler>"
+    return escape_html(text)
+
+
+def legacy_render(ud, caption):
+    prefix, suffix = ud.get('prefix', ''), ud.get('suffix', '')
+    caption_style = ud.get('caption_style', 'none')
+    mention_text = ud.get('mention_text', '')
+    link_wrap = ud.get('link_wrap', None)
+    composed = f"{prefix} {caption}".strip()
+    composed = insert_suffix_before_extension(composed, suffix)
+    if mention_text:
+        composed += f"\n\n{mention_text}"
+    final_caption = apply_style_to_text(composed, caption_style)
+    if link_wrap:
+        final_caption = f'<a href="{escape_html(link_wrap)}">{final_caption}</a>'
+    return final_caption
+
+
+def main():
+    for caption in CAPTIONS:
+        assert render_caption(SETTINGS, caption) == legacy_render(SETTINGS, caption), caption
+
+    number = 20000
+    for name, fn in (("legacy", legacy_render), ("compiled", render_caption)):
+        def run():
+            for caption in CAPTIONS:
+                fn(SETTINGS, caption)
+        best = min(timeit.repeat(run, number=number, repeat=5))
+        print(f"{name:>9}: {best / (number * len(CAPTIONS)) * 1e6:.2f} us/caption")
+
+
+if __name__ == "__main__":
+    main()
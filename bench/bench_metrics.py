@@ -0,0 +1,49 @@
+"""Overhead of the metrics instrumentation on the handler hot path.
+
+Run from the repository root:  python bench/bench_metrics.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+N = 200000
+
+
+async def handler(update, context):
+    return None
+
+
+timed_handler = metrics.timed("bench")(handler)
+
+
+async def run(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(N):
+        await fn(None, None)
+    return (time.perf_counter() - start) / N
+
+
+def main():
+    bare = min(asyncio.run(run(handler)) for _ in range(3))
+    wrapped = min(asyncio.run(run(timed_handler)) for _ in range(3))
+    print(f"bare handler:  {bare * 1e9:8.0f} ns/call")
+    print(f"timed handler: {wrapped * 1e9:8.0f} ns/call  (+{(wrapped - bare) * 1e9:.0f} ns)")
+
+    start = time.perf_counter()
+    for i in range(N):
+        metrics.api_latency.observe(0.05, "sendVideo")
+    print(f"observe():     {(time.perf_counter() - start) / N * 1e9:8.0f} ns/call")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        metrics.render()
+    print(f"render():      {(time.perf_counter() - start) / 1000 * 1e6:8.0f} us/scrape")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Micro-benchmark: URL detection on ordinary and adversarial messages.
+
+Compares urls.image_urls() with the URL_PATTERN regex it replaced. The regex's
+``(?:[...$-_...]|%[0-9a-fA-F]{2})+`` alternation can match "%41" two ways, so
+a run of percent escapes without an image extension backtracks exponentially;
+the new path stays linear in the message length.
+
+Run from the repository root:  python bench/bench_urls.py
+"""
+import datetime
+import os
+import re
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, MessageEntity  # noqa: E402
+
+from urls import image_urls  # noqa: E402
+
+URL_PATTERN = re.compile(
+    r'https?://(?:[a-zA-Z0-9$-_@.&+!*\'(),]|(?:%[0-9a-fA-F]{2}))+'
+    r'\.(?:jpg|jpeg|png|webp|bmp)(?:\?.*)?$',
+    re.IGNORECASE
+)
+
+CHAT = Chat(1, Chat.PRIVATE)
+DATE = datetime.datetime.now(datetime.timezone.utc)
+TEXT_LIMIT = 4096
+
+
+def message(text: str, urls=()) -> Message:
+    entities = []
+    for url in urls:
+        offset = len(text[:text.index(url)].encode("utf-16-le")) // 2
+        entities.append(MessageEntity(MessageEntity.URL, offset, len(url.encode("utf-16-le")) // 2))
+    return Message(1, DATE, CHAT, text=text, entities=entities)
+
+
+def legacy(text: str) -> bool:
+    return bool(URL_PATTERN.match(text.strip()))
+
+
+def per_call(fn, *args) -> float:
+    number, _ = timeit.Timer(lambda: fn(*args)).autorange()
+    return min(timeit.repeat(lambda: fn(*args), number=number, repeat=3)) / number
+
+
+CASES = {
+    "chat text (60 chars)": ("hey can you send the next episode tonight? thanks a lot 🙏", ()),
+    "chat text (4096 chars)": (("lorem ipsum dolor sit amet " * 200)[:TEXT_LIMIT], ()),
+    "one image URL (entity)": ("https://cdn.example.com/posters/frieren-s01.jpg",
+                               ("https://cdn.example.com/posters/frieren-s01.jpg",)),
+    "3 image URLs in text (entities)": (
+        "covers: https://a.example.com/1.jpg, https://b.example.com/2.png and https://c.example.com/3.webp",
+        ("https://a.example.com/1.jpg", "https://b.example.com/2.png", "https://c.example.com/3.webp")),
+    "4096 chars of 'http://' (no entities)": (("http://" * 600)[:TEXT_LIMIT], ()),
+    "4096-char URL, no extension (no entities)": ("http://" + "a." * 2040, ()),
+    "4096 chars of '%41' (no entities)": ("http://" + "%41" * 1363, ()),
+}
+
+
+def main():
+    print(f"{'case':<44}{'image_urls':>14}{'URL_PATTERN':>14}")
+    for name, (text, urls) in CASES.items():
+        msg = message(text, urls)
+        new = per_call(image_urls, msg)
+        if "%41" in text:
+            old = "exponential"
+        else:
+            old = f"{per_call(legacy, text) * 1e6:.2f} us"
+        print(f"{name:<44}{new * 1e6:>11.2f} us{old:>14}")
+
+    print("\n'http://' + '%41' * k + 'x' (no image extension):")
+    print(f"{'k':>4}{'image_urls':>14}{'URL_PATTERN':>14}")
+    for k in (8, 12, 16, 18, 20):
+        text = "http://" + "%41" * k + "x"
+        new = per_call(image_urls, message(text))
+        started = time.perf_counter()
+        legacy(text)
+        old = time.perf_counter() - started
+        print(f"{k:>4}{new * 1e6:>11.2f} us{old * 1e3:>11.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
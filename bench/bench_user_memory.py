@@ -0,0 +1,63 @@
+"""Memory benchmark: per-user settings as a plain dict vs. UserSettings.
+
+Users are loaded the way SQLitePersistence loads them (JSON row, then
+``setdefault`` into user_data) after a /settings visit seeded the defaults, so
+the dict case carries every default string per user.
+
+Run from the repository root:  python bench/bench_user_memory.py [users]
+"""
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_settings import UserSettings  # noqa: E402
+
+STYLES = ["none", "bold", "italic", "monospace", "blockquote"]
+
+
+def stored_rows(users: int):
+    rng = random.Random(1)
+    rows = []
+    for user_id in range(users):
+        data = {"caption_style": "none", "prefix": "", "suffix": "", "mention_text": "", "link_wrap": None}
+        data["thumb_file_id"] = f"AgACAgUAAxkBAAI{user_id:012d}x7f3Yk9QmW2pLr8sTnVb"
+        if rng.random() < 0.3:
+            data["caption_style"] = rng.choice(STYLES)
+        if rng.random() < 0.1:
+            data["prefix"] = "@MyChannel"
+        rows.append(json.dumps(data, sort_keys=True))
+    return rows
+
+
+def measure(rows, factory) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    user_data = {}
+    for user_id, raw in enumerate(rows):
+        data = user_data[user_id] = factory()
+        for key, value in json.loads(raw).items():
+            data.setdefault(key, value)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(rows)
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = stored_rows(users)
+    before = measure(rows, dict)
+    after = measure(rows, UserSettings)
+    print(f"{users} users, bytes per user (incl. user_data map entry)")
+    print(f"  dict          {before:8.0f}")
+    print(f"  UserSettings  {after:8.0f}  ({after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Local stand-in for the Telegram Bot API, for offline load tests.
+
+Answers the Bot API methods angel.py uses with plausible results, adds a
+configurable latency to every call, randomly answers with 429 RetryAfter, and
+serves 1920x1080 PNG posters under /img/ for URL thumbnails. GET /stats returns per-method
+call counts as JSON; POST /backlog appends to the updates getUpdates hands out, to
+simulate a restart with pending updates.
+"""
+import asyncio
+import json
+import random
+import re
+import struct
+import time
+import zlib
+from collections import Counter
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+from web import WebServer
+
+_MULTIPART_FIELD = re.compile(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', re.S)
+
+
+
+@lru_cache(maxsize=None)
+def fake_poster(name: str, width: int = 1920, height: int = 1080) -> bytes:
+    """A solid-colour PNG per name: real image data for the thumbnail normalizer to chew on."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    colour = bytes(zlib.crc32(name.encode()).to_bytes(4, "big")[:3])
+    rows = (b"\x00" + colour * width) * height
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows))
+            + chunk(b"IEND", b""))
+
+
+class FakeBotApi(WebServer):
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.02,
+                 jitter: float = 0.01, retry_after_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        super().__init__(wsgi_app=None, host=host, port=port)
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.items = Counter()
+        self.retry_afters = 0
+        self._message_ids = 0
+        self.backlog = []
+
+    async def start(self):
+        await super().start()
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _dispatch(self, method, path, query, headers, body):
+        if path.startswith("/img/"):
+            return 200, [("Content-Type", "image/png")], fake_poster(path)
+        if path == "/stats":
+            stats = {"calls": dict(self.calls), "items": dict(self.items), "retry_afters": self.retry_afters}
+            return 200, [("Content-Type", "application/json")], json.dumps(stats).encode()
+        if path == "/backlog":
+            self.backlog.extend(json.loads(body))
+            return self._reply({"ok": True, "result": len(self.backlog)})
+        api_method = path.rsplit("/", 1)[-1]
+        params = self._params(headers.get("content-type", ""), body)
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        self.calls[api_method] += 1
+        if api_method.startswith("send") and self.random.random() < self.retry_after_rate:
+            self.retry_afters += 1
+            return self._reply({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, 429)
+        return self._reply({"ok": True, "result": self._result(api_method, params)})
+
+    @staticmethod
+    def _params(content_type: str, body: bytes) -> dict:
+        if content_type.startswith("multipart/form-data"):
+            return {name.decode(): value.decode("utf-8", "replace") for name, value in _MULTIPART_FIELD.findall(body)}
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    @staticmethod
+    def _reply(payload: dict, status: int = 200):
+        return status, [("Content-Type", "application/json")], json.dumps(payload).encode()
+
+    def _message(self, params: dict, **extra) -> dict:
+        self._message_ids += 1
+        chat_id = params.get("chat_id", 1)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        message = {
+            "message_id": self._message_ids,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if isinstance(chat_id, int) and chat_id > 0 else "channel"},
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, api_method: str, params: dict):
+        if api_method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if api_method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            self.backlog = [update for update in self.backlog if update["update_id"] >= offset]
+            return self.backlog[:int(params.get("limit") or 100)]
+        if api_method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": len(self.backlog)}
+        if api_method == "sendPhoto":
+            n = self._message_ids
+            return self._message(params, photo=[{"file_id": f"photo{n}", "file_unique_id": f"u{n}",
+                                                 "width": 320, "height": 180}])
+        if api_method == "sendVideo":
+            self.items["videos"] += 1
+            return self._message(params, video={"file_id": params.get("video", "v"), "file_unique_id": "uv",
+                                                "width": 1280, "height": 720, "duration": 1})
+        if api_method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            self.items["videos"] += len(media)
+            return [self._message(params, media_group_id="g") for _ in media]
+        if api_method.startswith(("send", "edit")):
+            return self._message(params, text=params.get("text", ""))
+        return True
@@ -0,0 +1,291 @@
+"""Offline load test: replays synthetic update streams through the real Application.
+
+Starts bench/fake_bot_api.py in a child process, points the Application from
+angel.build_application() at it and pushes a mix of thumbnail photos, URL
+texts, /settings callback storms and video/document bursts from many simulated
+users. Reports throughput, p50/p99 handler latency, Bot API calls and peak RSS.
+
+Run from the repository root, e.g.:
+
+    python bench/loadtest.py --users 200 --updates 5000 --latency 0.02 --retry-after-rate 0.01
+
+With --catch-up the same stream is left pending at the fake API instead and
+processed by the startup catch-up (fetch, coalesce, process).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOKEN = "123456:BENCH"
+
+FILENAMES = [
+    "🔥 The Summer Hikaru Died S01 Ep {n:02d} [Hindi-English-Japanese] 1080p HEVC 10bit WEB-DL ESub ~ Aᴍɪᴛ ~ [TW4ALL].mkv",
+    "Solo Leveling S02E{n:02d} [Dual Audio] 720p x264 WEB-DL & ESubs.mp4",
+    "[SubsPlease] Frieren - {n:02d} (1080p) [A1B2C3D4].mkv",
+]
+# includes the double taps impatient users make
+CALLBACK_STORM = ["nav:page2", "style:bold", "style:bold", "nav:page3", "clear:prefix", "clear:prefix",
+                  "style:italic", "nav:page1", "nav:page1", "action:preview", "nav:page3"]
+
+
+def run_fake_api(conn, latency, retry_after_rate, seed):
+    from fake_bot_api import FakeBotApi
+
+    async def serve():
+        api = FakeBotApi(latency=latency, retry_after_rate=retry_after_rate, seed=seed)
+        await api.start()
+        conn.send(api.port)
+        await asyncio.Event().wait()
+
+    logging.disable(logging.CRITICAL)
+    asyncio.run(serve())
+
+
+class StreamBuilder:
+    def __init__(self, users: int, image_base: str, seed: int):
+        self.users = users
+        self.image_base = image_base
+        self.random = random.Random(seed)
+        self.message_id = 0
+        self.media_group = 0
+
+    def _message(self, uid: int, **fields) -> dict:
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private", "first_name": f"user{uid}"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}"},
+        }
+        message.update(fields)
+        return {"message": message}
+
+    def _command(self, uid: int, command: str) -> dict:
+        return self._message(uid, text=command, entities=[{"type": "bot_command", "offset": 0, "length": len(command)}])
+
+    def _photo(self, uid: int) -> dict:
+        n = self.message_id
+        return self._message(uid, photo=[{"file_id": f"thumb{n}", "file_unique_id": f"ut{n}", "width": 320, "height": 180}])
+
+    def _url(self, uid: int) -> dict:
+        # a small pool of popular posters, so the shared thumbnail cache gets hits
+        return self._message(uid, text=f"{self.image_base}/img/poster{self.random.randint(1, 20)}.jpg")
+
+    def _video(self, uid: int, n: int, media_group_id=None, document: bool = False) -> dict:
+        caption = self.random.choice(FILENAMES).format(n=n)
+        fields = {"caption": caption}
+        if media_group_id:
+            fields["media_group_id"] = media_group_id
+        file = {"file_id": f"video{self.message_id}", "file_unique_id": f"uv{self.message_id}"}
+        if document:
+            fields["document"] = dict(file, mime_type="video/x-matroska", file_name=caption)
+        else:
+            fields["video"] = dict(file, width=1280, height=720, duration=1440)
+        return self._message(uid, **fields)
+
+    def _callbacks(self, uid: int, menu_message_id: int):
+        for data in CALLBACK_STORM[:self.random.randint(3, len(CALLBACK_STORM))] + ["style:done"]:
+            self.message_id += 1
+            yield {"callback_query": {
+                "id": str(self.message_id),
+                "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}"},
+                "chat_instance": str(uid),
+                "data": data,
+                "message": {"message_id": menu_message_id, "date": int(time.time()),
+                            "chat": {"id": uid, "type": "private", "first_name": f"user{uid}"},
+                            "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                            "text": "Settings"},
+            }}
+
+    def user_stream(self, uid: int, length: int):
+        yield self._photo(uid)
+        produced = 1
+        while produced < length:
+            roll = self.random.random()
+            if roll < 0.5:
+                burst = self.random.randint(1, 12)
+                self.media_group += 1
+                group = f"mg{self.media_group}" if self.random.random() < 0.5 else None
+                for n in range(burst):
+                    yield self._video(uid, n + 1, media_group_id=group, document=self.random.random() < 0.2)
+                produced += burst
+            elif roll < 0.65:
+                yield self._photo(uid)
+                produced += 1
+            elif roll < 0.8:
+                yield self._url(uid)
+                produced += 1
+            else:
+                yield self._command(uid, "/settings")
+                menu_id = self.message_id
+                for callback in self._callbacks(uid, menu_id):
+                    yield callback
+                    produced += 1
+                produced += 1
+
+    def build(self, total: int) -> list:
+        per_user = max(2, total // self.users)
+        streams = [self.user_stream(uid, per_user) for uid in range(1000, 1000 + self.users)]
+        updates = []
+        # interleave users randomly while keeping each user's own order
+        while streams:
+            stream = self.random.choice(streams)
+            try:
+                updates.append(next(stream))
+            except StopIteration:
+                streams.remove(stream)
+        for update_id, update in enumerate(updates, 1):
+            update["update_id"] = update_id
+        return updates
+
+
+def histogram_quantile(histogram, quantile: float, *labels):
+    series = histogram._values.get(labels)
+    if not series:
+        return None
+    counts = series[:-1]
+    total = sum(counts)
+    target = quantile * total
+    cumulative, lower = 0, 0.0
+    for upper, count in zip(histogram.buckets + (float("inf"),), counts):
+        if count and cumulative + count >= target:
+            if upper == float("inf"):
+                return lower
+            return lower + (upper - lower) * (target - cumulative) / count
+        cumulative += count
+        lower = upper
+    return lower
+
+
+async def run(args, api_url: str) -> dict:
+    import angel
+    import metrics
+    from telegram import Update
+
+    logging.getLogger().setLevel(logging.WARNING)
+    app = angel.build_application(TOKEN, api_url=api_url)
+    updates = StreamBuilder(args.users, api_url, args.seed).build(args.updates)
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    if args.catch_up:
+        for i in range(0, len(updates), 500):
+            chunk = json.dumps(updates[i:i + 500]).encode()
+            urllib.request.urlopen(urllib.request.Request(f"{api_url}/backlog", data=chunk, method="POST")).close()
+        started = time.perf_counter()
+        await angel.catch_up.run(app)
+    else:
+        updates = [Update.de_json(data, app.bot) for data in updates]
+        started = time.perf_counter()
+        for update in updates:
+            await app.update_queue.put(update)
+        await app.update_queue.join()
+    processed = time.perf_counter() - started
+    await app.stop()
+    await app.post_stop(app)
+    drained = time.perf_counter() - started
+    loop_stats = angel.loop_monitor.stats()
+    await app.shutdown()
+    await app.post_shutdown(app)
+
+    with urllib.request.urlopen(f"{api_url}/stats") as res:
+        api_stats = json.load(res)
+
+    latency = {}
+    for handler in ("send_video", "handle_url_thumb", "settings_button_handler", "save_thumb"):
+        p50 = histogram_quantile(metrics.handler_latency, 0.5, handler)
+        p99 = histogram_quantile(metrics.handler_latency, 0.99, handler)
+        if p50 is not None:
+            latency[handler] = {"p50_ms": round(p50 * 1000, 2), "p99_ms": round(p99 * 1000, 2)}
+
+    api_latency = {}
+    for (method,) in list(metrics.api_latency._values):
+        api_latency[method] = round(histogram_quantile(metrics.api_latency, 0.5, method) * 1000, 2)
+
+    return {
+        "updates": len(updates),
+        "users": args.users,
+        "processing_seconds": round(processed, 3),
+        "updates_per_second": round(len(updates) / processed, 1),
+        "drain_seconds": round(drained, 3),
+        "videos_delivered": api_stats["items"].get("videos", 0),
+        "videos_per_second": round(api_stats["items"].get("videos", 0) / drained, 1),
+        "api_calls": api_stats["calls"],
+        "retry_afters_injected": api_stats["retry_afters"],
+        "handler_latency": latency,
+        "api_latency_p50_ms": api_latency,
+        "loop_lag_max_ms": round(loop_stats["lag_max_seconds"] * 1000, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "catch_up": angel.catch_up.stats() if args.catch_up else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Bot API latency per call (s)")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0,
+                        help="fraction of send* calls answered with 429 RetryAfter")
+    parser.add_argument("--no-flood-limits", action="store_true",
+                        help="lift the outbound flood limits to measure raw processing throughput")
+    parser.add_argument("--catch-up", action="store_true",
+                        help="serve the stream as a pending backlog and process it with the startup catch-up")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["PERSISTENCE_FILE"] = os.path.join(workdir, "bot_data.sqlite3")
+    os.environ["CATCHUP_SPOOL_FILE"] = os.path.join(workdir, "catchup.sqlite3")
+    os.environ["SEND_JOB_FILE"] = os.path.join(workdir, "send_jobs.sqlite3")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("VIDEO_BATCH_WINDOW", "0.5")
+    if args.no_flood_limits:
+        os.environ["FLOOD_GLOBAL_RATE"] = "100000"
+        os.environ["FLOOD_PRIVATE_CHAT_RATE"] = "100000"
+        os.environ["FLOOD_CHAT_BURST"] = "100000"
+
+    parent, child = multiprocessing.Pipe()
+    api = multiprocessing.Process(target=run_fake_api, args=(child, args.latency, args.retry_after_rate, args.seed),
+                                  daemon=True)
+    api.start()
+    try:
+        report = asyncio.run(run(args, f"http://127.0.0.1:{parent.recv()}"))
+    finally:
+        api.terminate()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"updates:          {report['updates']} from {report['users']} users")
+    print(f"processing:       {report['processing_seconds']}s -> {report['updates_per_second']} updates/s")
+    print(f"videos delivered: {report['videos_delivered']} in {report['drain_seconds']}s "
+          f"-> {report['videos_per_second']} videos/s")
+    print(f"api calls:        {report['api_calls']}")
+    print(f"api p50 latency:  {report['api_latency_p50_ms']} ms")
+    print(f"retry_after:      {report['retry_afters_injected']} injected")
+    for handler, values in report["handler_latency"].items():
+        print(f"{handler:>24}: p50 {values['p50_ms']} ms, p99 {values['p99_ms']} ms")
+    print(f"loop lag max:     {report['loop_lag_max_ms']} ms")
+    print(f"peak RSS:         {report['peak_rss_mb']} MB")
+    if report["catch_up"]:
+        print(f"catch-up:         {report['catch_up']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from typing import Mapping, Tuple
+
+CAPTION_LIMIT = 1024
+ELLIPSIS = "…"
+RENDERER_CACHE_SIZE = 4096
+
+VIDEO_EXTENSIONS = frozenset(("mkv", "mp4", "avi", "mov", "webm", "m4v", "flv"))
+
+STYLE_TAGS = {
+    "blockquote": ("<blockquote>", "</blockquote>"),
+    "pre": ("<pre>", "</pre>"),
+    "bold": ("<b>", "</b>"),
+    "italic": ("<i>", "</i>"),
+    "monospace": ("<code>", "</code>"),
+    "underline": ("<u>", "</u>"),
+    "strikethrough": ("<s>", "</s>"),
+    "spoiler": ("<tg-spoiler>", "</tg-spoiler>"),
+}
+
+
+def escape_html(text: str) -> str:
+    if "&" not in text and "<" not in text and ">" not in text:
+        return text
+    return (
+        text.replace("&", "&amp;")
+            .replace("<", "&lt;")
+            .replace(">", "&gt;")
+    )
+
+
+def utf16_len(text: str) -> int:
+    # Telegram counts caption length in UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _cut_utf16(text: str, units: int) -> str:
+    # a surrogate pair cut in half is dropped by errors="ignore"
+    return text.encode("utf-16-le")[:units * 2].decode("utf-16-le", errors="ignore")
+
+
+class CaptionRenderer:
+    """A user's caption settings compiled into a reusable renderer.
+
+    The HTML wrapper and the escaped suffix/mention are built once, so rendering
+    a caption only escapes the incoming text. Truncation to ``CAPTION_LIMIT`` is
+    done on the plain text before escaping, which is what Telegram counts after
+    entity parsing, so a tag or entity is never cut; the suffix and mention are
+    kept and the caption body is shortened.
+    """
+
+    __slots__ = ("prefix", "suffix", "_suffix_html", "_mention", "_mention_html", "_open", "_close")
+
+    def __init__(self, prefix: str = "", suffix: str = "", style: str = "none",
+                 mention_text: str = "", link_wrap: str = None):
+        self.prefix = prefix or ""
+        self.suffix = suffix or ""
+        self._suffix_html = escape_html(self.suffix)
+        self._mention = f"\n\n{mention_text}" if mention_text else ""
+        self._mention_html = escape_html(self._mention)
+        open_tag, close_tag = STYLE_TAGS.get(style, ("", ""))
+        if link_wrap:
+            open_tag = f'<a href="{escape_html(link_wrap)}">{open_tag}'
+            close_tag = f"{close_tag}</a>"
+        self._open = open_tag
+        self._close = close_tag
+
+    def render(self, caption: str) -> str:
+        text = f"{self.prefix} {caption}".strip() if self.prefix else caption.strip()
+        tail = tail_html = ""
+        if self.suffix:
+            base, dot, ext = text.rpartition(".")
+            if dot and ext.lower() in VIDEO_EXTENSIONS:
+                text = base
+                tail = f" {self.suffix}.{ext}"
+                tail_html = f" {self._suffix_html}.{ext}"
+            else:
+                tail = f" {self.suffix}"
+                tail_html = f" {self._suffix_html}"
+        tail += self._mention
+        tail_html += self._mention_html
+        if not text and not tail:
+            return ""
+        # each char is at most 2 UTF-16 units, so short captions skip the exact count
+        if (len(text) + len(tail)) * 2 > CAPTION_LIMIT:
+            text, truncated_tail = self._truncate(text, tail)
+            if truncated_tail != tail:
+                tail_html = escape_html(truncated_tail)
+        return f"{self._open}{escape_html(text)}{tail_html}{self._close}"
+
+    @staticmethod
+    def _truncate(text: str, tail: str) -> Tuple[str, str]:
+        text_len, tail_len = utf16_len(text), utf16_len(tail)
+        if text_len + tail_len <= CAPTION_LIMIT:
+            return text, tail
+        budget = CAPTION_LIMIT - tail_len - 1
+        if budget > 0:
+            return _cut_utf16(text, budget) + ELLIPSIS, tail
+        return _cut_utf16(text + tail, CAPTION_LIMIT - 1) + ELLIPSIS, ""
+
+
+def _settings_key(user_data: Mapping) -> tuple:
+    return (
+        user_data.get("prefix", "") or "",
+        user_data.get("suffix", "") or "",
+        user_data.get("caption_style", "none") or "none",
+        user_data.get("mention_text", "") or "",
+        user_data.get("link_wrap") or "",
+    )
+
+
+class RendererCache:
+    """LRU of compiled renderers keyed by the settings they were built from.
+
+    Users with identical settings share a renderer, and a settings change simply
+    maps to a different key, so nothing has to be invalidated explicitly.
+    """
+
+    def __init__(self, max_size: int = RENDERER_CACHE_SIZE):
+        self.max_size = max_size
+        self._renderers: "OrderedDict[tuple, CaptionRenderer]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_data: Mapping) -> CaptionRenderer:
+        key = _settings_key(user_data)
+        renderer = self._renderers.get(key)
+        if renderer is not None:
+            self._renderers.move_to_end(key)
+            self.hits += 1
+            return renderer
+        self.misses += 1
+        renderer = self._renderers[key] = CaptionRenderer(*key)
+        if len(self._renderers) > self.max_size:
+            self._renderers.popitem(last=False)
+        return renderer
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._renderers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+renderers = RendererCache()
+
+
+def render_caption(user_data: Mapping, caption: str) -> str:
+    return renderers.get(user_data).render(caption)
@@ -0,0 +1,237 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+from collections import Counter
+from typing import Dict, Hashable, List, Optional
+
+from telegram import Bot, Update
+from telegram.error import RetryAfter
+
+from flood import retry_after_seconds
+from shards import ShardQueue
+
+logger = logging.getLogger(__name__)
+
+STARTUP_BACKLOG = os.getenv("STARTUP_BACKLOG", "catchup").lower()
+CATCHUP_CALLBACK_MAX_AGE = float(os.getenv("CATCHUP_CALLBACK_MAX_AGE", "900"))
+CATCHUP_SPOOL_FILE = os.getenv("CATCHUP_SPOOL_FILE", "catchup.sqlite3")
+CATCHUP_PROGRESS_INTERVAL = 10.0
+CATCHUP_MAX_IN_FLIGHT = 1024
+
+# callbacks that only move around the menu; settings changes are never in here
+UI_CALLBACK_PREFIXES = ("nav:", "action:", "confirm:", "cancel:")
+
+
+class CatchUp:
+    """Processes the updates that queued up at Telegram while the bot was down.
+
+    ``fetch`` drains them with large getUpdates batches, ``coalesce`` drops work
+    a later update in the backlog makes pointless, and ``process`` runs the rest
+    through the application's update processor, in order, at full concurrency,
+    logging progress as it goes.
+
+    ``run`` spools the backlog to ``spool_file`` before confirming it to
+    Telegram, and deletes updates from the spool only once they are processed
+    and the settings they changed are written, so a crash during catch-up
+    leaves the rest to the next start.
+    """
+
+    def __init__(self, callback_max_age: float = CATCHUP_CALLBACK_MAX_AGE,
+                 progress_interval: float = CATCHUP_PROGRESS_INTERVAL, spool_file: str = CATCHUP_SPOOL_FILE):
+        self.callback_max_age = callback_max_age
+        self.progress_interval = progress_interval
+        self.spool_file = spool_file
+        self._offset: Optional[int] = None
+        self._done: List[int] = []
+        self.pending = 0
+        self.fetched = 0
+        self.dropped: Counter = Counter()
+        self.processed = 0
+        self.total = 0
+        self.seconds = 0.0
+
+    async def fetch(self, bot: Bot) -> List[Update]:
+        # getUpdates is refused while a webhook is set; keep what it queued
+        await bot.delete_webhook(drop_pending_updates=False)
+        self.pending = (await bot.get_webhook_info()).pending_update_count
+        if self.pending:
+            logger.info(f"Catch-up: fetching {self.pending} pending updates")
+        updates: List[Update] = []
+        offset = None
+        while True:
+            try:
+                batch = await bot.get_updates(offset=offset, limit=100, timeout=0,
+                                              allowed_updates=Update.ALL_TYPES)
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e))
+                continue
+            if not batch:
+                break
+            updates.extend(batch)
+            offset = batch[-1].update_id + 1
+        self._offset = offset
+        self.fetched = len(updates)
+        return updates
+
+    async def confirm(self, bot: Bot):
+        """Confirms the fetched backlog so Telegram doesn't deliver it again; only once it is stored."""
+        if self._offset is not None:
+            await bot.get_updates(offset=self._offset, limit=1, timeout=0, allowed_updates=Update.ALL_TYPES)
+            self._offset = None
+
+    def coalesce(self, updates: List[Update]) -> List[Update]:
+        """Drops updates superseded by a later one from the same user.
+
+        - thumbnail photos replaced by the user's next message, itself a photo
+        - style picks replaced by a later pick with no other update of the
+          user in between (videos are captioned with the style in effect)
+        - menu navigation on a menu that is stale or gets another tap later
+        """
+        expired = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=self.callback_max_age)
+        next_message_is_photo: Dict[int, bool] = {}
+        style_picked_later: Dict[int, bool] = {}
+        tapped_later = set()
+        kept = []
+        for update in reversed(updates):
+            user = update.effective_user
+            if user is None:
+                kept.append(update)
+                continue
+            query = update.callback_query
+            if query is not None:
+                data = query.data or ""
+                menu: Optional[Hashable] = None
+                if query.message is not None:
+                    menu = (query.message.chat.id, query.message.message_id)
+                if data.startswith(UI_CALLBACK_PREFIXES):
+                    if query.message is None or query.message.date < expired:
+                        self.dropped["stale_callbacks"] += 1
+                        continue
+                    if menu in tapped_later:
+                        self.dropped["superseded_callbacks"] += 1
+                        continue
+                elif data.startswith("style:") and data != "style:done":
+                    if style_picked_later.get(user.id):
+                        self.dropped["superseded_styles"] += 1
+                        continue
+                    style_picked_later[user.id] = True
+                else:
+                    style_picked_later[user.id] = False
+                tapped_later.add(menu)
+                kept.append(update)
+                continue
+            style_picked_later[user.id] = False
+            is_photo = bool(update.message and update.message.photo)
+            if is_photo and next_message_is_photo.get(user.id):
+                self.dropped["superseded_thumbnails"] += 1
+                continue
+            next_message_is_photo[user.id] = is_photo
+            kept.append(update)
+        kept.reverse()
+        if self.dropped:
+            logger.info(f"Catch-up: coalesced {len(updates)} updates to {len(kept)} ({dict(self.dropped)})")
+        return kept
+
+    async def process(self, app, updates: List[Update], spool: Optional[ShardQueue] = None,
+                      rows: Optional[Dict[int, int]] = None):
+        self.total = len(updates)
+        started = time.monotonic()
+        reporter = asyncio.create_task(self._report_every(started, app, spool))
+        slots = asyncio.Semaphore(CATCHUP_MAX_IN_FLIGHT)
+        tasks = set()
+
+        async def handle(update: Update):
+            try:
+                await app.update_processor.process_replayed(update, app.process_update(update))
+            except Exception:
+                logger.exception(f"Catch-up: update {update.update_id} failed")
+            finally:
+                self.processed += 1
+                if rows is not None:
+                    self._done.append(rows[update.update_id])
+                slots.release()
+
+        try:
+            for update in updates:
+                await slots.acquire()
+                # tasks start in creation order, so each user's updates stay in order
+                task = asyncio.create_task(handle(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            reporter.cancel()
+        if spool is not None:
+            await self._checkpoint(app, spool)
+        self.seconds = time.monotonic() - started
+        self._report(self.seconds)
+
+    async def _report_every(self, started: float, app, spool: Optional[ShardQueue]):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self._report(time.monotonic() - started)
+            if spool is not None:
+                await self._checkpoint(app, spool)
+
+    async def _checkpoint(self, app, spool: ShardQueue):
+        # the persistence job isn't running yet in polling mode; write settings before forgetting their updates
+        ids, self._done = self._done, []
+        if app.persistence is not None:
+            await app.update_persistence()
+            if not await app.persistence.written():
+                # processed again on the next start, unless a later checkpoint gets them written
+                self._done = ids + self._done
+                logger.warning(f"Catch-up: settings couldn't be written; keeping {len(ids)} updates spooled")
+                return
+        if ids:
+            await self._run(spool.ack, ids)
+
+    def _report(self, elapsed: float):
+        rate = self.processed / elapsed if elapsed else 0.0
+        eta = (self.total - self.processed) / rate if rate else 0.0
+        logger.info(f"Catch-up: {self.processed}/{self.total} updates processed, "
+                    f"{rate:.0f} updates/s, ETA {eta:.0f}s")
+
+    @staticmethod
+    async def _run(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def run(self, app):
+        spool = ShardQueue(self.spool_file)
+        try:
+            left = await self._run(spool.depth)
+            if left:
+                logger.info(f"Catch-up: resuming {left} updates spooled before a restart")
+            fetched = await self.fetch(app.bot)
+            await self._run(spool.put_many, [(update.update_id, json.dumps(update.to_dict(), ensure_ascii=False))
+                                             for update in fetched])
+            await self.confirm(app.bot)
+            spooled = await self._run(spool.read, 0, -1)
+            rows = {}
+            updates = []
+            for row_id, data in spooled:
+                update = Update.de_json(json.loads(data), app.bot)
+                rows[update.update_id] = row_id
+                updates.append(update)
+            updates = self.coalesce(updates)
+            kept = {update.update_id for update in updates}
+            self._done = [row_id for update_id, row_id in rows.items() if update_id not in kept]
+            if updates:
+                await self.process(app, updates, spool, rows)
+            elif self._done:
+                await self._checkpoint(app, spool)
+        finally:
+            await self._run(spool.close)
+
+    def stats(self) -> dict:
+        return {
+            "pending_at_start": self.pending,
+            "fetched": self.fetched,
+            "dropped": dict(self.dropped),
+            "processed": self.processed,
+            "remaining": self.total - self.processed,
+        }
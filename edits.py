@@ -0,0 +1,77 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from telegram import CallbackQuery, InlineKeyboardMarkup, Message
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "10000"))
+
+
+def _is_not_modified(error: BadRequest) -> bool:
+    return "message is not modified" in error.message.lower()
+
+
+class MessageEditor:
+    """Edits bot messages, skipping edits that would not change them.
+
+    Remembers the last text, parse mode and markup sent to each message in a
+    bounded LRU, so repeated menu taps that render the same page (re-picking
+    the active style, clearing an empty field) cost no Bot API call. Markups
+    are compared by identity first, which is why static keyboards are shared
+    module constants.
+    """
+
+    def __init__(self, max_size: int = EDIT_CACHE_SIZE):
+        self.max_size = max_size
+        self._sent: "OrderedDict[Hashable, Tuple]" = OrderedDict()
+        self.edits = 0
+        self.skipped = 0
+        self.not_modified = 0
+
+    def _store(self, key: Hashable, state: Tuple):
+        self._sent[key] = state
+        self._sent.move_to_end(key)
+        if len(self._sent) > self.max_size:
+            self._sent.popitem(last=False)
+
+    def remember(self, message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                 parse_mode: Optional[str] = None):
+        """Records a message the bot just sent, so a first no-op edit is skipped too."""
+        self._store((message.chat.id, message.message_id), (text, parse_mode, reply_markup))
+
+    async def edit(self, query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                   parse_mode: Optional[str] = None) -> bool:
+        """Edits the message behind ``query``; returns False when the edit was skipped."""
+        if query.message is not None:
+            key = (query.message.chat.id, query.message.message_id)
+        else:
+            key = query.inline_message_id
+        state = (text, parse_mode, reply_markup)
+        if self._sent.get(key) == state:
+            self._sent.move_to_end(key)
+            self.skipped += 1
+            return False
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        except BadRequest as e:
+            if not _is_not_modified(e):
+                # the message may or may not have changed; don't trust the cache
+                self._sent.pop(key, None)
+                raise
+            self.not_modified += 1
+        else:
+            self.edits += 1
+        self._store(key, state)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "tracked_messages": len(self._sent),
+            "edits": self.edits,
+            "skipped": self.skipped,
+            "not_modified": self.not_modified,
+        }
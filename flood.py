@@ -0,0 +1,226 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.getenv("FLOOD_GLOBAL_RATE", "30"))
+PRIVATE_CHAT_RATE = float(os.getenv("FLOOD_PRIVATE_CHAT_RATE", "1"))
+GROUP_CHAT_RATE = float(os.getenv("FLOOD_GROUP_CHAT_RATE", str(20 / 60)))
+CHAT_BURST = float(os.getenv("FLOOD_CHAT_BURST", "3"))
+MAX_RETRIES = int(os.getenv("FLOOD_MAX_RETRIES", "3"))
+
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BULK: "bulk"}
+
+ENDPOINT_PRIORITY = {
+    "answerCallbackQuery": INTERACTIVE,
+    "editMessageText": INTERACTIVE,
+    "editMessageReplyMarkup": INTERACTIVE,
+    "editMessageCaption": INTERACTIVE,
+    "sendVideo": BULK,
+    "sendMediaGroup": BULK,
+    "sendDocument": BULK,
+}
+
+# not sends, so not subject to flood limits
+UNLIMITED_ENDPOINTS = frozenset((
+    "getUpdates", "getMe", "getFile", "getWebhookInfo", "setWebhook", "deleteWebhook",
+    "logOut", "close",
+))
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TokenBucket:
+    """Token bucket whose waiters are served by priority, then arrival order.
+
+    ``pause`` blocks the bucket (for a ``RetryAfter``) without affecting other
+    buckets; waiting time is accumulated for tuning.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.acquired = 0
+        self.delayed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return not self._waiters and self.tokens >= self.capacity and now >= self.blocked_until
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        if self._waiters or now < self.blocked_until or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.acquired += 1
+        return True
+
+    async def acquire(self, priority: int = NORMAL) -> float:
+        if self.try_acquire():
+            return 0.0
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wake()
+        await future
+        waited = time.monotonic() - start
+        self.acquired += 1
+        self.delayed += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self._wake()
+
+    def _wake(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters:
+            if now < self.blocked_until:
+                delay = self.blocked_until - now
+                break
+            if self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                break
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+        else:
+            return
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def stats(self) -> dict:
+        return {
+            "acquired": self.acquired,
+            "delayed": self.delayed,
+            "waiting": len(self._waiters),
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+        }
+
+
+class FloodControlLimiter(BaseRateLimiter):
+    """Outbound Bot API scheduler enforcing Telegram's flood limits.
+
+    Every request takes a token from its chat's bucket (1/s in private chats,
+    20/min in groups and channels) and from the global bucket. A ``RetryAfter``
+    pauses only the affected chat's bucket and the request is retried, so other
+    chats keep flowing. Interactive calls (callback answers, menu edits) are
+    served before normal replies and bulk video sends; a call can override its
+    priority with ``rate_limit_args={"priority": ...}``.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, private_rate: float = PRIVATE_CHAT_RATE,
+                 group_rate: float = GROUP_CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 max_retries: int = MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._prune_at = 1024
+        self.retry_afters = 0
+        self.chat_wait_total = 0.0
+        self.chat_wait_max = 0.0
+        self.priority_wait = {name: 0.0 for name in PRIORITY_NAMES.values()}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        logger.info(f"Flood control stats: {self.stats()}")
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._prune_at:
+                for key in [key for key, b in self._chat_buckets.items() if b.idle]:
+                    del self._chat_buckets[key]
+                self._prune_at = max(1024, 2 * len(self._chat_buckets))
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = self.private_rate if is_private else self.group_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def process_request(self, callback, args: Any, kwargs: Dict[str, Any], endpoint: str,
+                              data: Dict[str, Any], rate_limit_args: Optional[Any]):
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        priority = ENDPOINT_PRIORITY.get(endpoint, NORMAL)
+        if isinstance(rate_limit_args, dict):
+            priority = rate_limit_args.get("priority", priority)
+        chat_id = data.get("chat_id")
+        # callback answers don't count against the chat's message limit
+        chat_bucket = None
+        if chat_id is not None and endpoint != "answerCallbackQuery":
+            chat_bucket = self._chat_bucket(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            waited = 0.0
+            if chat_bucket is not None:
+                chat_waited = await chat_bucket.acquire(priority)
+                self.chat_wait_total += chat_waited
+                self.chat_wait_max = max(self.chat_wait_max, chat_waited)
+                waited += chat_waited
+            waited += await self.global_bucket.acquire(priority)
+            self.priority_wait[PRIORITY_NAMES.get(priority, "normal")] += waited
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_after_seconds(e)
+                self.retry_afters += 1
+                logger.warning(f"RetryAfter {delay}s on {endpoint} for chat {chat_id}, "
+                               f"retry {attempt + 1}/{self.max_retries}")
+                (chat_bucket or self.global_bucket).pause(delay)
+
+    def stats(self) -> dict:
+        return {
+            "global": self.global_bucket.stats(),
+            "chats": {
+                "buckets": len(self._chat_buckets),
+                "wait_total": self.chat_wait_total,
+                "wait_max": self.chat_wait_max,
+            },
+            "priority_wait_total": dict(self.priority_wait),
+            "retry_afters": self.retry_afters,
+        }
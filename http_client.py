@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "4"))
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+FETCH_TIMEOUT = float(os.getenv("HTTP_FETCH_TIMEOUT", "15"))
+
+
+class FetchError(Exception):
+    pass
+
+
+class ImageFetcher:
+    """Shared, pooled HTTP client for downloading thumbnail images.
+
+    One keep-alive connection pool serves every user; a per-host semaphore keeps a
+    single slow host from taking all connections, and bodies are streamed with a
+    hard size cap so oversized or non-image responses are dropped early.
+    """
+
+    def __init__(self, max_bytes: int = MAX_IMAGE_BYTES, per_host: int = PER_HOST_LIMIT,
+                 max_connections: int = MAX_CONNECTIONS, timeout: float = FETCH_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.per_host = per_host
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        # host -> [semaphore, number of fetches using it]; dropped when idle
+        self._hosts: Dict[str, List] = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections // 2,
+                    keepalive_expiry=30,
+                ),
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                follow_redirects=True,
+                max_redirects=3,
+                headers={"User-Agent": "ThumbnailCoverBot/1.0", "Accept": "image/*"},
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch_image(self, url: str) -> bytes:
+        if self._client is None:
+            await self.start()
+        host = (urlsplit(url).hostname or "").lower()
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.per_host), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await asyncio.wait_for(self._download(url), self.timeout)
+        except asyncio.TimeoutError:
+            raise FetchError(f"timed out after {self.timeout}s") from None
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._hosts.pop(host, None)
+
+    async def _download(self, url: str) -> bytes:
+        try:
+            async with self._client.stream("GET", url) as res:
+                res.raise_for_status()
+                content_type = res.headers.get("content-type", "").lower()
+                if not content_type.startswith("image/"):
+                    raise FetchError(f"not an image: {content_type or 'unknown type'}")
+                length = res.headers.get("content-length")
+                if length and length.isdigit() and int(length) > self.max_bytes:
+                    raise FetchError(f"image too large: {length} bytes")
+                body = bytearray()
+                async for chunk in res.aiter_bytes():
+                    body += chunk
+                    if len(body) > self.max_bytes:
+                        raise FetchError(f"image larger than {self.max_bytes} bytes")
+                return bytes(body)
+        except httpx.HTTPError as e:
+            raise FetchError(str(e) or type(e).__name__) from e
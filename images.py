@@ -0,0 +1,162 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: thumbnails are then sent as downloaded
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+THUMB_MAX_SIDE = int(os.getenv("THUMB_MAX_SIDE", "1280"))
+THUMB_MAX_BYTES = int(os.getenv("THUMB_MAX_BYTES", str(512 * 1024)))
+THUMB_JPEG_QUALITY = int(os.getenv("THUMB_JPEG_QUALITY", "85"))
+# refuse to decode anything larger (decompression bombs)
+THUMB_MAX_PIXELS = 50_000_000
+
+
+class ImageError(Exception):
+    pass
+
+
+def normalize_image(content: bytes, max_side: int = THUMB_MAX_SIDE, max_bytes: int = THUMB_MAX_BYTES,
+                    quality: int = THUMB_JPEG_QUALITY) -> bytes:
+    """Returns ``content`` as an RGB JPEG no larger than ``max_side`` on either side.
+
+    JPEGs that already fit and are at most ``max_bytes`` are returned as they
+    are; anything else is decoded, rotated upright, flattened onto white,
+    downscaled and recompressed, lowering the quality until it fits
+    ``max_bytes``. Runs in the image worker processes.
+    """
+    try:
+        image = Image.open(io.BytesIO(content))
+        if image.width * image.height > THUMB_MAX_PIXELS:
+            raise ImageError(f"image too large: {image.width}x{image.height}")
+        if (image.format == "JPEG" and image.mode in ("RGB", "L") and len(content) <= max_bytes
+                and max(image.size) <= max_side and image.getexif().get(0x0112, 1) == 1):
+            return content
+        # JPEGs can be decoded at a fraction of their size straight away
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    except ImageError:
+        raise
+    except Exception as e:
+        raise ImageError(f"can't decode image: {e}") from None
+    for q in (quality, 70, 55):
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=q, optimize=True, progressive=True)
+        if out.tell() <= max_bytes:
+            break
+    return out.getvalue()
+
+
+def _warm_up():
+    pass
+
+
+class ImageNormalizer:
+    """Normalizes thumbnail images in a process pool, off the event loop.
+
+    Decoding and resizing is CPU-bound, so it runs in ``workers`` separate
+    processes. Callers look the source image up by content hash in the
+    thumbnail cache first, so each distinct image is normalized once; the same
+    image requested again while it is being processed waits for that result.
+    Without Pillow, or with ``workers`` set to 0, images pass through unchanged.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.normalized = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None and self.workers > 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # no fork: the bot process runs threads (logging, persistence)
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def start(self):
+        """Starts the worker processes in the background so the first thumbnail doesn't wait for them."""
+        if not self.enabled:
+            if self.workers > 0:
+                logger.warning("Pillow is not installed; URL thumbnails are sent without normalization")
+            return
+        self._executor().submit(_warm_up)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def normalize(self, content: bytes, digest: str) -> bytes:
+        if not self.enabled:
+            return content
+        future = self._in_flight.get(digest)
+        if future is not None:
+            self.deduplicated += 1
+            return await self._result(future)
+        future = self._submit(content)
+        self._in_flight[digest] = future
+        try:
+            result = await self._result(future)
+        except ImageError:
+            self.failed += 1
+            raise
+        finally:
+            self._in_flight.pop(digest, None)
+        self.normalized += 1
+        self.bytes_in += len(content)
+        self.bytes_out += len(result)
+        return result
+
+    def _submit(self, content: bytes) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        try:
+            return loop.run_in_executor(self._executor(), normalize_image, content)
+        except BrokenProcessPool:
+            # a worker died (e.g. crashed decoding an image); replace the pool
+            self.close()
+            return loop.run_in_executor(self._executor(), normalize_image, content)
+
+    @staticmethod
+    async def _result(future: asyncio.Future) -> bytes:
+        try:
+            # shared by every caller waiting for this image; one giving up doesn't cancel it
+            return await asyncio.shield(future)
+        except BrokenProcessPool:
+            raise ImageError("image worker crashed") from None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers if self.enabled else 0,
+            "in_flight": len(self._in_flight),
+            "normalized": self.normalized,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
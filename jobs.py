@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, InvalidToken, NetworkError, RetryAfter
+
+from batching import QueuedVideo
+from flood import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+SEND_JOB_FILE = os.getenv("SEND_JOB_FILE", "send_jobs.sqlite3")
+SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", "6"))
+SEND_RETRY_BASE = float(os.getenv("SEND_RETRY_BASE", "5"))
+SEND_RETRY_MAX = float(os.getenv("SEND_RETRY_MAX", "600"))
+SEND_JOB_RETENTION = float(os.getenv("SEND_JOB_RETENTION", str(7 * 24 * 3600)))
+SEND_JOB_POLL_INTERVAL = 1.0
+SEND_JOB_PURGE_INTERVAL = 3600.0
+SEND_JOB_BATCH_SIZE = 500
+
+PENDING, SENT, FAILED = "pending", "sent", "failed"
+# next_attempt_at of jobs held by the batcher: not due until they fail
+IN_FLIGHT = float("inf")
+
+_JOB_COLUMNS = ("job_key, destination, user_id, chat_id, media_group_id, message_id, file_id, caption, cover, "
+                "item_key, attempts")
+
+
+def job_key(file_unique_id: str, caption: str, cover: str) -> str:
+    """The video plus a version of the settings applied to it: its rendered caption and cover."""
+    version = hashlib.blake2b(f"{caption}\0{cover}".encode(), digest_size=8).hexdigest()
+    return f"{file_unique_id}:{version}"
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, (BadRequest, Forbidden, InvalidToken, ChatMigrated)):
+        return False
+    # RetryAfter, TimedOut and other network errors
+    return isinstance(error, (RetryAfter, NetworkError))
+
+
+class SendJob(NamedTuple):
+    key: str
+    destination: Union[int, str]
+    user_id: int
+    chat_id: int
+    media_group_id: Optional[str]
+    item: QueuedVideo
+    attempts: int
+
+
+class SendJobStore:
+    """SQLite table of send jobs, one row per video and destination.
+
+    Rows are unique by ``job_key``; sent and failed rows are kept for the
+    retention period so a redelivered update isn't sent again. Not
+    thread-safe: use it from one thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS send_jobs ("
+                "job_key TEXT PRIMARY KEY, item_key TEXT NOT NULL, destination NOT NULL, "
+                "user_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, "
+                "media_group_id TEXT, file_id TEXT NOT NULL, caption TEXT NOT NULL, cover TEXT NOT NULL, "
+                "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, "
+                "last_error TEXT, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS send_jobs_due ON send_jobs (state, next_attempt_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def add(self, jobs: Sequence[SendJob]) -> List[Optional[Tuple[str, int]]]:
+        """Inserts new jobs and re-arms failed ones and ones sent from another message, all as in flight.
+
+        Returns None for those, and (state, message_id) for jobs that are
+        pending or were sent from this same message already.
+        """
+        conn = self._connection()
+        now = time.time()
+        existing = []
+        with conn:
+            for job in jobs:
+                item = job.item
+                cursor = conn.execute(
+                    "INSERT INTO send_jobs (job_key, item_key, destination, user_id, chat_id, message_id, "
+                    "media_group_id, file_id, caption, cover, state, next_attempt_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(job_key) DO UPDATE SET state = excluded.state, attempts = 0, "
+                    "next_attempt_at = excluded.next_attempt_at, last_error = NULL, chat_id = excluded.chat_id, "
+                    "message_id = excluded.message_id, updated_at = excluded.updated_at "
+                    "WHERE send_jobs.state = 'failed' OR (send_jobs.state = 'sent' "
+                    "AND (send_jobs.message_id != excluded.message_id OR send_jobs.chat_id != excluded.chat_id))",
+                    (job.key, item.key, job.destination, job.user_id, job.chat_id, item.message_id,
+                     job.media_group_id, item.file_id, item.caption, item.cover, PENDING, IN_FLIGHT, now),
+                )
+                if cursor.rowcount:
+                    existing.append(None)
+                else:
+                    existing.append(conn.execute(
+                        "SELECT state, message_id FROM send_jobs WHERE job_key = ?", (job.key,)).fetchone())
+        return existing
+
+    @staticmethod
+    def _job(row: tuple) -> SendJob:
+        return SendJob(row[0], row[1], row[2], row[3], row[4], QueuedVideo(*row[5:10]), row[10])
+
+    def due(self, now: float, limit: int) -> List[SendJob]:
+        """Pending jobs whose retry is due."""
+        rows = self._connection().execute(
+            f"SELECT {_JOB_COLUMNS} FROM send_jobs WHERE state = ? AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT ?",
+            (PENDING, now, limit),
+        ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def pending_after(self, after_key: str, limit: int) -> List[SendJob]:
+        """All pending jobs, in key order, for resuming after a restart."""
+        rows = self._connection().execute(
+            f"SELECT {_JOB_COLUMNS} FROM send_jobs WHERE state = ? AND job_key > ? ORDER BY job_key LIMIT ?",
+            (PENDING, after_key, limit),
+        ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def claim(self, keys: Sequence[str]):
+        """Marks jobs as handed to the batcher, so they aren't due again until they fail."""
+        conn = self._connection()
+        with conn:
+            conn.executemany("UPDATE send_jobs SET next_attempt_at = ? WHERE job_key = ?",
+                             [(IN_FLIGHT, key) for key in keys])
+
+    def attempts(self, keys: Iterable[str]) -> Dict[str, int]:
+        keys = list(keys)
+        placeholders = ",".join("?" * len(keys))
+        return dict(self._connection().execute(
+            f"SELECT job_key, attempts FROM send_jobs WHERE job_key IN ({placeholders})", keys).fetchall())
+
+    def update(self, changes: Sequence[Tuple[str, str, Optional[int], float, Optional[str]]]):
+        """Applies (job_key, state, attempts or None to keep them, next_attempt_at, error) rows."""
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "UPDATE send_jobs SET state = ?, attempts = COALESCE(?, attempts), next_attempt_at = ?, "
+                "last_error = ?, updated_at = ? WHERE job_key = ?",
+                [(state, attempts, next_at, error, now, key) for key, state, attempts, next_at, error in changes],
+            )
+
+    def pending(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM send_jobs WHERE state = ?", (PENDING,)).fetchone()[0]
+
+    def purge(self, before: float) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                "DELETE FROM send_jobs WHERE state != ? AND updated_at < ?", (PENDING, before)).rowcount
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class SendJobQueue:
+    """Durable, idempotent delivery of re-covered videos.
+
+    ``enqueue`` records one job per video and destination before the video is
+    handed to the batcher. A redelivered update whose video was already sent
+    (same message, settings and destination) is not sent again, and one still
+    pending from an earlier message is sent once; sending the video again in a
+    new message sends it again. ``on_result`` marks jobs sent, or schedules
+    them for another attempt with exponential backoff on transient errors, up
+    to ``max_attempts``; jobs left pending by a crash are resumed on the next
+    start. Jobs coming back through ``resend`` go through the batcher again.
+    The user is told when their videos fail for good, and when delayed ones
+    finally go out. Delivery is at least once: a send that timed out may have
+    gone through and is retried.
+    """
+
+    def __init__(self, path: str = SEND_JOB_FILE, max_attempts: int = SEND_MAX_ATTEMPTS,
+                 retry_base: float = SEND_RETRY_BASE, retry_max: float = SEND_RETRY_MAX,
+                 retention: float = SEND_JOB_RETENTION):
+        self.store = SendJobStore(path)
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="send-jobs")
+        # job_key -> (chat to notify, whether the job was delayed), for jobs handed to the batcher
+        self._in_flight: Dict[str, Tuple[int, bool]] = {}
+        self._runner: Optional[asyncio.Task] = None
+        self._notices = set()
+        self.pending = 0
+        self.enqueued = 0
+        self.duplicates = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.resumed = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def enqueue(self, item: QueuedVideo, user_id: int, chat_id: int, media_group_id: Optional[str],
+                      destinations: Sequence[Union[int, str]]) -> Tuple[Tuple[Union[int, str], ...], int]:
+        """Returns the destinations to send to now and how many still wait to get this video from an earlier message."""
+        jobs = [SendJob(f"{item.key}:{destination}", destination, user_id, chat_id, media_group_id, item, 0)
+                for destination in destinations]
+        existing = await self._run(self.store.add, jobs)
+        send_now, repeats = [], 0
+        for job, row in zip(jobs, existing):
+            if row is None:
+                self._in_flight[job.key] = (chat_id, False)
+                send_now.append(job.destination)
+            elif row[1] != item.message_id:
+                # a redelivered update has the same message id; don't report that
+                repeats += 1
+        self.enqueued += len(send_now)
+        self.duplicates += len(jobs) - len(send_now)
+        return tuple(send_now), repeats
+
+    async def on_result(self, bot, destination: Union[int, str], items: List[QueuedVideo],
+                        error: Optional[BaseException]):
+        keys = [f"{item.key}:{destination}" for item in items if item.key]
+        if not keys:
+            return
+        notify = {key: self._in_flight.pop(key, (None, False)) for key in keys}
+        chat_id = next((chat for chat, _ in notify.values() if chat is not None), None)
+        where = "" if destination == chat_id else f" to {destination}"
+        if error is None:
+            await self._run(self.store.update, [(key, SENT, None, 0.0, None) for key in keys])
+            self.sent += len(keys)
+            delayed = sum(1 for _, was_delayed in notify.values() if was_delayed)
+            if delayed and chat_id is not None:
+                self._notify(bot, chat_id, f"✅ {delayed} delayed video(s) sent{where}.")
+            return
+        attempts = await self._run(self.store.attempts, keys)
+        attempt = max(attempts.values(), default=0) + 1
+        # one delay for the whole chunk, so an album is retried as an album
+        delay = self.backoff(attempt)
+        if isinstance(error, RetryAfter):
+            delay = max(delay, retry_after_seconds(error))
+        retry = is_transient(error)
+        retry_at = time.time() + delay
+        changes = []
+        gave_up = 0
+        for key in keys:
+            key_attempt = attempts.get(key, 0) + 1
+            if retry and key_attempt < self.max_attempts:
+                changes.append((key, PENDING, key_attempt, retry_at, str(error)))
+                self.retries += 1
+            else:
+                changes.append((key, FAILED, key_attempt, 0.0, str(error)))
+                gave_up += 1
+        await self._run(self.store.update, changes)
+        self.failed += gave_up
+        if gave_up and chat_id is not None:
+            self._notify(bot, chat_id, f"❌ Couldn't send {gave_up} video(s){where}: {error}")
+
+    def _notify(self, bot, chat_id: int, text: str):
+        async def send():
+            try:
+                await bot.send_message(chat_id, text)
+            except Exception as e:
+                logger.warning(f"Send job notice to {chat_id} failed: {e}")
+
+        task = asyncio.create_task(send())
+        self._notices.add(task)
+        task.add_done_callback(self._notices.discard)
+
+    def start(self, resend: Callable[[SendJob], None], owns: Optional[Callable[[int], bool]] = None):
+        """Resumes jobs left pending by the last run and retries failed sends when they are due."""
+        self._runner = asyncio.create_task(self._run_jobs(resend, owns))
+
+    async def _dispatch(self, jobs: List[SendJob], resend: Callable[[SendJob], None],
+                        owns: Optional[Callable[[int], bool]]) -> int:
+        jobs = [job for job in jobs
+                if job.key not in self._in_flight and (owns is None or owns(job.user_id))]
+        if jobs:
+            await self._run(self.store.claim, [job.key for job in jobs])
+        for job in jobs:
+            self._in_flight[job.key] = (job.chat_id, True)
+            resend(job)
+        return len(jobs)
+
+    async def _run_jobs(self, resend: Callable[[SendJob], None], owns: Optional[Callable[[int], bool]]):
+        # whatever is pending at start was in flight or waiting when the last run ended
+        after_key = ""
+        while True:
+            jobs = await self._run(self.store.pending_after, after_key, SEND_JOB_BATCH_SIZE)
+            if not jobs:
+                break
+            self.resumed += await self._dispatch(jobs, resend, owns)
+            after_key = jobs[-1].key
+        if self.resumed:
+            logger.info(f"Resumed {self.resumed} send jobs")
+        purge_at = 0.0
+        while True:
+            await asyncio.sleep(SEND_JOB_POLL_INTERVAL)
+            try:
+                jobs = await self._run(self.store.due, time.time(), SEND_JOB_BATCH_SIZE)
+                await self._dispatch(jobs, resend, owns)
+                self.pending = await self._run(self.store.pending)
+                if time.monotonic() >= purge_at:
+                    purge_at = time.monotonic() + SEND_JOB_PURGE_INTERVAL
+                    await self._run(self.store.purge, time.time() - self.retention)
+            except Exception:
+                logger.exception("Send job queue pass failed")
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        if self._notices:
+            await asyncio.gather(*list(self._notices), return_exceptions=True)
+        await self._run(self.store.close)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "in_flight": len(self._in_flight),
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "resumed": self.resumed,
+        }
@@ -0,0 +1,175 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "thumbnail_bot_ptb.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_CONSOLE_FORMAT = os.getenv("LOG_CONSOLE_FORMAT", "text").lower()
+LOG_SAMPLE_PER_SECOND = int(os.getenv("LOG_SAMPLE_PER_SECOND", "20"))
+LOG_QUEUE_SIZE = 10000
+
+TEXT_FORMAT = "[%(asctime)s] %(levelname)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "msg": record.getMessage(),
+        }
+        sampled_out = getattr(record, "sampled_out", 0)
+        if sampled_out:
+            entry["sampled_out"] = sampled_out
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False)
+
+
+JsonFormatter.converter = time.gmtime
+
+
+class SamplingFilter(logging.Filter):
+    """Passes at most ``per_second`` INFO/DEBUG records per call site each second.
+
+    Per-update lines (one httpx line per Bot API request, handler chatter) are
+    kept in full at normal load and sampled under load; the next record that
+    passes carries how many were dropped as ``sampled_out``. Warnings and
+    errors always pass.
+    """
+
+    def __init__(self, per_second: int = LOG_SAMPLE_PER_SECOND):
+        super().__init__()
+        self.per_second = per_second
+        # (logger, line) -> [window start, passed in window, dropped since last pass]
+        self._sites: Dict[Tuple[str, int], list] = {}
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.per_second <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.lineno)
+        window = int(record.created)
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = [window, 0, 0]
+        elif site[0] != window:
+            site[0], site[1] = window, 0
+        if site[1] >= self.per_second:
+            site[2] += 1
+            self.sampled_out += 1
+            return False
+        site[1] += 1
+        if site[2]:
+            record.sampled_out = site[2]
+            site[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the writer falls behind."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # keep the record structured for the formatters on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _file_handler(filename: str) -> logging.Handler:
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            filename, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", utc=True)
+    return logging.handlers.RotatingFileHandler(
+        filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+
+
+def _process_log_file(filename: str) -> Optional[str]:
+    # each shard worker rotates its own file; rotation isn't safe across processes
+    name = multiprocessing.current_process().name
+    if name == "MainProcess":
+        return filename
+    if not name.startswith("worker-"):
+        # pool processes (image normalization) only log to the console
+        return None
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{name}{ext}"
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_sampler: Optional[SamplingFilter] = None
+
+
+def setup_logging():
+    """Routes all logging through a queue to a writer thread (console + rotating JSON file)."""
+    global _listener, _queue_handler, _sampler
+    if _listener is not None:
+        return
+    console = logging.StreamHandler()
+    console.setFormatter(JsonFormatter() if LOG_CONSOLE_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+    log_file = _process_log_file(LOG_FILE) if LOG_FILE else None
+    if log_file:
+        file_handler = _file_handler(log_file)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    _sampler = SamplingFilter()
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(_sampler)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Writes out queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats() -> dict:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "sampled_out": _sampler.sampled_out if _sampler else 0,
+    }
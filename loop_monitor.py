@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from metrics import Histogram, registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_CHECK_INTERVAL = float(os.getenv("LOOP_CHECK_INTERVAL", "0.1"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.25"))
+LOOP_UNHEALTHY_LAG = float(os.getenv("LOOP_UNHEALTHY_LAG", "2"))
+LOOP_REPORT_INTERVAL = float(os.getenv("LOOP_REPORT_INTERVAL", "60"))
+
+loop_lag = registry.register(Histogram(
+    "bot_event_loop_lag_seconds", "Event loop scheduling lag.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+
+
+class LoopMonitor:
+    """Measures event loop lag and reports callbacks that block the loop.
+
+    A loop task wakes every ``interval`` seconds and records how late it woke
+    up. A watcher thread checks that heartbeat; when the loop has not come back
+    for ``threshold`` seconds it captures the loop thread's current stack (the
+    code holding the loop) and logs it, at most once per ``report_interval``.
+    """
+
+    def __init__(self, interval: float = LOOP_CHECK_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD,
+                 unhealthy_lag: float = LOOP_UNHEALTHY_LAG, report_interval: float = LOOP_REPORT_INTERVAL):
+        self.interval = interval
+        self.threshold = threshold
+        self.unhealthy_lag = unhealthy_lag
+        self.report_interval = report_interval
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._beat = time.monotonic()
+        self._recent = deque(maxlen=max(1, int(10 / interval)))
+        self._last_report = 0.0
+        self.lag = 0.0
+        self.lag_max = 0.0
+        self.stalls = 0
+        self.suppressed_reports = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            self.lag = max(0.0, now - started - self.interval)
+            self.lag_max = max(self.lag_max, self.lag)
+            self._recent.append(self.lag)
+            loop_lag.observe(self.lag)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            self.stalls += 1
+            now = time.monotonic()
+            if now - self._last_report < self.report_interval:
+                self.suppressed_reports += 1
+                continue
+            self._last_report = now
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            logger.warning(
+                f"Event loop blocked for {stalled:.3f}s+ ({self.suppressed_reports} reports suppressed "
+                f"since last); loop thread stack:\n{stack}"
+            )
+            self.suppressed_reports = 0
+
+    def current_stall(self) -> float:
+        if not self.running:
+            return 0.0
+        return max(0.0, time.monotonic() - self._beat - self.interval)
+
+    def healthy(self) -> bool:
+        if not self.running:
+            return True
+        recent = max(self._recent) if self._recent else 0.0
+        return max(recent, self.current_stall()) < self.unhealthy_lag
+
+    def stats(self) -> dict:
+        return {
+            "lag_seconds": self.lag,
+            "lag_max_seconds": self.lag_max,
+            "stall_seconds": self.current_stall(),
+            "stalls": self.stalls,
+            "healthy": int(self.healthy()),
+        }
+
+
+monitor = LoopMonitor()
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_FILE = os.getenv("PERSISTENCE_FILE", "bot_data.sqlite3")
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "10"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+USER_IDLE_TTL = float(os.getenv("USER_IDLE_TTL", "3600"))
+USER_EVICT_INTERVAL = 60.0
+# well past any handler, which may still hold its user's data
+USER_EVICT_MIN_IDLE = 300.0
+
+
+class SQLitePersistence(BasePersistence):
+    """user_data persistence with one SQLite row per user.
+
+    Rows are loaded lazily on a user's first update (``refresh_user_data``), only
+    users whose data actually changed are written, and writes are batched into
+    one WAL transaction on a dedicated thread, off the request path.
+
+    A failed write is retried every ``update_interval`` seconds until
+    ``flush``, which makes one last attempt and logs the rows it couldn't write.
+
+    The users kept in memory are bounded: ``evict`` writes out and unloads users
+    idle for ``idle_ttl`` seconds, and the least recently seen ones beyond
+    ``max_users``; their row is reloaded on their next update.
+    """
+
+    def __init__(self, filepath: str = PERSISTENCE_FILE, update_interval: float = PERSISTENCE_INTERVAL,
+                 max_users: int = USER_CACHE_SIZE, idle_ttl: float = USER_IDLE_TTL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.filepath = filepath
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        # user_id -> hash of the last stored JSON, for users already loaded
+        self._stored: Dict[int, int] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        # user_id -> JSON to write, or None to delete the row
+        self._pending: Dict[int, Optional[str]] = {}
+        self._writing: Dict[int, Optional[str]] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._closing = False
+        # set by flush(): stop waiting to retry
+        self._wake: Optional[asyncio.Event] = None
+        # resolved when a write fails, for written()
+        self._failed: Optional[asyncio.Future] = None
+        # user_id -> last seen (monotonic), least recently seen first
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+        self._evictor: Optional[asyncio.Task] = None
+        self.rows_written = 0
+        self.batches_written = 0
+        self.write_failures = 0
+        self.evicted = 0
+
+    # -------------------------
+    # SQLite (persistence thread only)
+    # -------------------------
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.filepath, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_data ("
+                "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _load_row(self, user_id: int) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT data FROM user_data WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write_batch(self, batch: Dict[int, Optional[str]]):
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(uid, data, now) for uid, data in batch.items() if data is not None],
+            )
+            conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(uid,) for uid, data in batch.items() if data is None],
+            )
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # -------------------------
+    # Write-behind
+    # -------------------------
+    def _schedule_write(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            self._writing = batch
+            try:
+                await self._run(self._write_batch, batch)
+            except Exception:
+                # keep newer values queued meanwhile
+                self._pending = {**batch, **self._pending}
+                self.write_failures += 1
+                if self._failed is not None:
+                    self._failed.set_result(None)
+                    self._failed = None
+                if self._closing:
+                    # flush() reports what's left
+                    return
+                logger.exception(f"Failed to persist {len(batch)} user rows, will retry")
+                if self._wake is None:
+                    self._wake = asyncio.Event()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.update_interval)
+                except asyncio.TimeoutError:
+                    pass
+                if self._closing:
+                    return
+                continue
+            finally:
+                self._writing = {}
+            self.rows_written += len(batch)
+            self.batches_written += 1
+
+    # -------------------------
+    # user_data
+    # -------------------------
+    async def get_user_data(self) -> dict:
+        # loaded lazily in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        self._seen[user_id] = time.monotonic()
+        self._seen.move_to_end(user_id)
+        if user_id in self._stored:
+            return
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            await loading
+            return
+        loading = self._loading[user_id] = asyncio.get_running_loop().create_future()
+        try:
+            if user_id in self._pending or user_id in self._writing:
+                # evicted before its last write landed
+                raw = self._pending[user_id] if user_id in self._pending else self._writing[user_id]
+            else:
+                raw = await self._run(self._load_row, user_id)
+            if raw is not None:
+                for key, value in json.loads(raw).items():
+                    user_data.setdefault(key, value)
+            self._stored[user_id] = hash(raw)
+        finally:
+            del self._loading[user_id]
+            loading.set_result(None)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._queue(user_id, data)
+
+    def _queue(self, user_id: int, data) -> bool:
+        raw = json.dumps(dict(data), sort_keys=True, ensure_ascii=False) if data else None
+        if self._stored.get(user_id, hash(None)) == hash(raw):
+            return False
+        self._stored[user_id] = hash(raw)
+        self._pending[user_id] = raw
+        self._schedule_write()
+        return True
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stored[user_id] = hash(None)
+        self._pending[user_id] = None
+        self._schedule_write()
+
+    # -------------------------
+    # Working set
+    # -------------------------
+    def evict(self, user_data: dict, busy: Callable[[int], bool]) -> int:
+        """Unloads idle users from ``user_data`` after queueing their last write.
+
+        Unlike ``Application.drop_user_data`` this keeps the stored row. Users
+        seen in the last ``USER_EVICT_MIN_IDLE`` seconds and users for whom
+        ``busy`` is true are never evicted.
+        """
+        now = time.monotonic()
+        excess = len(self._seen) - self.max_users
+        victims = []
+        for user_id, seen in self._seen.items():
+            idle = now - seen
+            if idle < USER_EVICT_MIN_IDLE or (idle < self.idle_ttl and len(victims) >= excess):
+                break
+            if user_id not in self._loading and not busy(user_id):
+                victims.append(user_id)
+        for user_id in victims:
+            data = user_data.pop(user_id, None)
+            if data is not None:
+                self._queue(user_id, data)
+            del self._seen[user_id]
+            self._stored.pop(user_id, None)
+        self.evicted += len(victims)
+        return len(victims)
+
+    def start_eviction(self, application, busy: Callable[[int], bool]):
+        self._evictor = asyncio.create_task(self._evict_every(application, busy))
+
+    async def _evict_every(self, application, busy: Callable[[int], bool]):
+        while True:
+            await asyncio.sleep(USER_EVICT_INTERVAL)
+            # users marked for the next persistence run must still be in user_data
+            marked = application._user_ids_to_be_updated_in_persistence
+
+            def skip(user_id: int) -> bool:
+                return user_id in marked or busy(user_id)
+
+            # there's no public way to unload user_data without deleting the row
+            evicted = self.evict(application._user_data, skip)
+            if evicted:
+                logger.info(f"Evicted {evicted} idle users, {len(self._seen)} in memory")
+
+    async def written(self) -> bool:
+        """Waits until the rows queued so far are in the database; False as soon as a write fails."""
+        while self._writer is not None and not self._writer.done():
+            if self._failed is None:
+                self._failed = asyncio.get_running_loop().create_future()
+            failed = self._failed
+            await asyncio.wait([self._writer, failed], return_when=asyncio.FIRST_COMPLETED)
+            if failed.done():
+                return False
+        return True
+
+    async def flush(self) -> None:
+        if self._evictor is not None:
+            self._evictor.cancel()
+            self._evictor = None
+        self._closing = True
+        if self._wake is not None:
+            self._wake.set()
+        if self._writer is not None:
+            await self._writer
+        if self._pending:
+            # one last attempt, without retries
+            await self._drain()
+        if self._pending:
+            lost = sorted(self._pending)
+            logger.error(f"Could not persist {len(lost)} user rows; their latest changes are lost "
+                         f"(users {lost[:20]}{' ...' if len(lost) > 20 else ''})")
+            self._pending = {}
+        try:
+            await self._run(self._close)
+        except Exception:
+            logger.exception("Closing the persistence database failed")
+        logger.info(f"Persistence flushed: {self.rows_written} rows in {self.batches_written} batches")
+
+    def stats(self) -> dict:
+        return {
+            "loaded_users": len(self._stored),
+            "evicted": self.evicted,
+            "pending_rows": len(self._pending),
+            "rows_written": self.rows_written,
+            "batches_written": self.batches_written,
+            "write_failures": self.write_failures,
+        }
+
+    # -------------------------
+    # Not stored
+    # -------------------------
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "4096"))
+ORDER_UPDATES_BY = os.getenv("ORDER_UPDATES_BY", "user")
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different users concurrently, each user's in order.
+
+    Every update waits for the previous update with the same key (user or chat)
+    before taking one of ``concurrency`` global slots, so a slow handler only
+    delays its own user and ConversationHandler states still see messages in
+    the order they were sent. ``max_pending`` bounds the number of updates held
+    in memory, including those waiting for their turn. Updates for which
+    ``admit`` returns False are dropped before any handler or persistence work;
+    updates replayed from a backlog (``process_replayed``) are admitted with
+    ``throttle=False``.
+    """
+
+    def __init__(self, concurrency: int = MAX_CONCURRENT_UPDATES, max_pending: int = MAX_PENDING_UPDATES,
+                 order_by: str = ORDER_UPDATES_BY, admit: Optional[Callable[..., bool]] = None):
+        if order_by not in ("user", "chat"):
+            raise ValueError(f"order_by must be 'user' or 'chat', not {order_by!r}")
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self.order_by = order_by
+        self.admit = admit
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+        self._depth: Counter = Counter()
+        self.queued = 0
+        self.in_flight = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_key_depth = 0
+
+    def _key(self, update: object) -> Optional[Hashable]:
+        if not isinstance(update, Update):
+            return None
+        user, chat = update.effective_user, update.effective_chat
+        if self.order_by == "chat" and chat is not None:
+            return "chat", chat.id
+        if user is not None:
+            return "user", user.id
+        if chat is not None:
+            return "chat", chat.id
+        return None
+
+    async def process_replayed(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """``process_update`` for an update that queued up earlier, e.g. while the bot was down."""
+        async with self._semaphore:
+            await self.do_process_update(update, coroutine, replayed=True)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any], replayed: bool = False) -> None:
+        if self.admit is not None and not self.admit(update, throttle=not replayed):
+            coroutine.close()
+            self.dropped += 1
+            return
+        key = self._key(update)
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+            self._depth[key] += 1
+            self.max_key_depth = max(self.max_key_depth, self._depth[key])
+        self.queued += 1
+        started = False
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with self._slots:
+                self.queued -= 1
+                self.in_flight += 1
+                started = True
+                try:
+                    await coroutine
+                finally:
+                    self.in_flight -= 1
+                    self.processed += 1
+        finally:
+            if not started:
+                self.queued -= 1
+                coroutine.close()
+            if not started and previous is not None and not previous.done():
+                # cancelled while waiting: updates behind this one still wait for the one before it
+                previous.add_done_callback(lambda _: done.set_result(None))
+                if self._tails.get(key) is done:
+                    self._tails[key] = previous
+            else:
+                done.set_result(None)
+            if key is not None:
+                self._depth[key] -= 1
+                if not self._depth[key]:
+                    del self._depth[key]
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+    def user_busy(self, user_id: int) -> bool:
+        """Whether updates keyed by this user (or their private chat) are queued or running."""
+        return ("user", user_id) in self._depth or ("chat", user_id) in self._depth
+
+    async def initialize(self) -> None:
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        logger.info(f"Update processor stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "active_keys": len(self._depth),
+            "max_key_depth": self.max_key_depth,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,366 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+SHARD_QUEUE_DIR = os.getenv("SHARD_QUEUE_DIR", "shard_queues")
+SHARD_POLL_INTERVAL = float(os.getenv("SHARD_POLL_INTERVAL", "0.05"))
+SHARD_BATCH_SIZE = 100
+SHARD_MAX_IN_FLIGHT = 1024
+WORKER_RESTART_DELAY = 1.0
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def update_key(data: dict) -> Optional[int]:
+    """The user id of a raw update (the chat id if there is no user), as used for sharding."""
+    for field, value in data.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+class HashRing:
+    """Consistent hash ring: changing the shard count moves only ~1/N of the keys."""
+
+    def __init__(self, shards: int, replicas: int = 128):
+        self.shards = shards
+        points = sorted((_hash(f"shard-{shard}-{replica}"), shard)
+                        for shard in range(shards) for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, key) -> int:
+        if self.shards == 1:
+            return 0
+        return self._owners[bisect(self._points, _hash(str(key))) % len(self._points)]
+
+    def shard_for_update(self, data: dict) -> int:
+        key = update_key(data)
+        return self.shard_for(key if key is not None else data.get("update_id", 0))
+
+
+def queue_path(queue_dir: str, shard: int) -> str:
+    return os.path.join(queue_dir, f"shard-{shard}.sqlite3")
+
+
+class ShardQueue:
+    """Durable FIFO of raw updates for one shard, in its own SQLite file.
+
+    The ingress appends, the shard's worker reads past its cursor and deletes
+    rows once they are processed, so updates survive a worker restart and are
+    redelivered (at least once). Not thread-safe: use it from one thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS updates ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, update_id INTEGER UNIQUE, data TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def put_many(self, rows: List[Tuple[int, str]]):
+        conn = self._connection()
+        with conn:
+            # a webhook retry of an update still queued is ignored
+            conn.executemany("INSERT OR IGNORE INTO updates (update_id, data) VALUES (?, ?)", rows)
+
+    def read(self, after: int, limit: int) -> List[Tuple[int, str]]:
+        return self._connection().execute(
+            "SELECT id, data FROM updates WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+        ).fetchall()
+
+    def ack(self, ids: List[int]):
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM updates WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def depth(self) -> int:
+        return self._connection().execute("SELECT count(*) FROM updates").fetchone()[0]
+
+    def last_id(self) -> int:
+        return self._connection().execute("SELECT coalesce(max(id), 0) FROM updates").fetchone()[0]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class ShardRouter:
+    """Ingress side: appends each update to its shard's queue.
+
+    ``route`` returns once the update is durably queued. Updates arriving
+    together (a getUpdates batch, concurrent webhook requests) are committed in
+    one transaction per shard on a dedicated thread.
+    """
+
+    def __init__(self, shards: int = WORKERS, queue_dir: str = SHARD_QUEUE_DIR):
+        self.ring = HashRing(shards)
+        self.queue_dir = queue_dir
+        self._queues = [ShardQueue(queue_path(queue_dir, shard)) for shard in range(shards)]
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shard-router")
+        self._pending: List[Tuple[int, Tuple[int, str], asyncio.Future]] = []
+        self._writer: Optional[asyncio.Task] = None
+        self.routed = [0] * shards
+        self.depths = [0] * shards
+        self.batches = 0
+        self.moved = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def start(self):
+        self.moved = await self._run(self._rebalance)
+        if self.moved:
+            logger.info(f"Moved {self.moved} queued updates to their new shards")
+
+    def _rebalance(self) -> int:
+        # updates queued under a different shard count go to their current shard, in order
+        moved = 0
+        for path in sorted(glob.glob(queue_path(self.queue_dir, "*"))):
+            source = ShardQueue(path)
+            shard = int(os.path.basename(path)[len("shard-"):-len(".sqlite3")])
+            rows = source.read(0, -1)
+            stray = [(row_id, data) for row_id, data in rows
+                     if shard >= self.ring.shards or self.ring.shard_for_update(json.loads(data)) != shard]
+            for row_id, data in stray:
+                update = json.loads(data)
+                self._queues[self.ring.shard_for_update(update)].put_many([(update.get("update_id"), data)])
+            source.ack([row_id for row_id, _ in stray])
+            source.close()
+            if shard >= self.ring.shards:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+            moved += len(stray)
+        return moved
+
+    async def route(self, data: dict):
+        shard = self.ring.shard_for_update(data)
+        done = asyncio.get_running_loop().create_future()
+        self._pending.append((shard, (data.get("update_id"), json.dumps(data, ensure_ascii=False)), done))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._drain())
+        await done
+
+    async def _drain(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            by_shard: Dict[int, List[Tuple[int, str]]] = {}
+            for shard, row, _ in batch:
+                by_shard.setdefault(shard, []).append(row)
+            try:
+                await self._run(self._write, by_shard)
+            except Exception as e:
+                for _, _, done in batch:
+                    done.set_exception(e)
+                continue
+            for shard, rows in by_shard.items():
+                self.routed[shard] += len(rows)
+            self.batches += 1
+            for _, _, done in batch:
+                done.set_result(None)
+
+    def _write(self, by_shard: Dict[int, List[Tuple[int, str]]]):
+        for shard, rows in by_shard.items():
+            self._queues[shard].put_many(rows)
+
+    async def refresh_depths(self):
+        self.depths = await self._run(lambda: [queue.depth() for queue in self._queues])
+
+    async def close(self):
+        if self._writer is not None:
+            await self._writer
+        await self._run(lambda: [queue.close() for queue in self._queues])
+        self._executor.shutdown()
+
+    def stats(self) -> dict:
+        return {
+            "shards": self.ring.shards,
+            "routed": sum(self.routed),
+            "batches": self.batches,
+            "queued": {str(shard): depth for shard, depth in enumerate(self.depths)},
+        }
+
+
+class ShardConsumer:
+    """Worker side: feeds one shard's queue to ``process`` and acks what finished.
+
+    Rows are started in queue order (so a per-user ordered update processor sees
+    each user's updates in order) with at most ``max_in_flight`` outstanding, and
+    deleted only after ``process`` returned or raised. ``process`` is told
+    whether a row was already queued when the consumer started (a redelivery
+    or the startup backlog) rather than arriving live.
+    """
+
+    def __init__(self, shard: int, process: Callable[[dict, bool], Awaitable[None]],
+                 queue_dir: str = SHARD_QUEUE_DIR, batch_size: int = SHARD_BATCH_SIZE,
+                 max_in_flight: int = SHARD_MAX_IN_FLIGHT, poll_interval: float = SHARD_POLL_INTERVAL):
+        self.shard = shard
+        self.process = process
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self._queue = ShardQueue(queue_path(queue_dir, shard))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"shard-{shard}")
+        self._done: List[int] = []
+        self._tasks = set()
+        self.received = 0
+        self.acked = 0
+        self.failed = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def run(self, stop: asyncio.Event):
+        slots = asyncio.Semaphore(self.max_in_flight)
+        cursor = 0
+        replay_until = await self._run(self._queue.last_id)
+        while not stop.is_set():
+            await self._ack()
+            rows = await self._run(self._queue.read, cursor, self.batch_size)
+            if not rows:
+                try:
+                    await asyncio.wait_for(stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for row_id, data in rows:
+                await slots.acquire()
+                cursor = row_id
+                self.received += 1
+                task = asyncio.create_task(self._handle(row_id, data, row_id <= replay_until, slots))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._ack()
+        await self._run(self._queue.close)
+        self._executor.shutdown()
+
+    async def _handle(self, row_id: int, data: str, replayed: bool, slots: asyncio.Semaphore):
+        try:
+            await self.process(json.loads(data), replayed)
+        except Exception:
+            # redelivering would fail the same way; errors are the handlers' business
+            self.failed += 1
+            logger.exception(f"Shard {self.shard} failed to process queued update {row_id}")
+        finally:
+            self._done.append(row_id)
+            slots.release()
+
+    async def _ack(self):
+        if self._done:
+            ids, self._done = self._done, []
+            await self._run(self._queue.ack, ids)
+            self.acked += len(ids)
+
+    def stats(self) -> dict:
+        return {
+            "shard": self.shard,
+            "received": self.received,
+            "in_flight": len(self._tasks),
+            "acked": self.acked,
+            "failed": self.failed,
+        }
+
+
+class WorkerPool:
+    """Runs ``target(shard)`` in one process per shard and restarts any that exit."""
+
+    def __init__(self, target: Callable[[int], None], workers: int = WORKERS,
+                 restart_delay: float = WORKER_RESTART_DELAY):
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        # spawn: don't fork the ingress's event loop and threads into the workers
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._started: List[float] = [0.0] * workers
+        self.restarts = 0
+
+    def _spawn(self, shard: int):
+        process = self._context.Process(target=self.target, args=(shard,), name=f"worker-{shard}")
+        process.start()
+        self._processes[shard] = process
+        self._started[shard] = time.monotonic()
+        logger.info(f"Started worker {shard} (pid {process.pid})")
+
+    def start(self):
+        for shard in range(self.workers):
+            self._spawn(shard)
+
+    async def supervise(self, stop: asyncio.Event, on_tick: Optional[Callable[[], Awaitable[None]]] = None):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+            if stop.is_set():
+                break
+            for shard, process in enumerate(self._processes):
+                if process is None or process.is_alive():
+                    continue
+                logger.warning(f"Worker {shard} exited with code {process.exitcode}; restarting")
+                if time.monotonic() - self._started[shard] < self.restart_delay * 5:
+                    # crashing on start: don't spin
+                    await asyncio.sleep(self.restart_delay)
+                self.restarts += 1
+                self._spawn(shard)
+            if on_tick is not None:
+                await on_tick()
+
+    def _stop(self, timeout: float):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {process.name} did not stop in {timeout}s; killing it")
+                process.kill()
+                process.join()
+
+    async def stop(self, timeout: float = 30.0):
+        await asyncio.get_running_loop().run_in_executor(None, self._stop, timeout)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self._processes if process is not None and process.is_alive()),
+            "restarts": self.restarts,
+        }
@@ -1,2 +1,3 @@
 #!/bin/bash
-gunicorn app:app & python3 angel.py
+# one process: the bot serves the app.py routes itself (the webhook too, in webhook mode)
+exec python3 angel.py
@@ -0,0 +1,53 @@
+import asyncio
+
+from telegram import Update
+
+from access import AccessGate
+
+
+def update(update_id: int, user_id: int, **content) -> Update:
+    message = {"message_id": update_id, "date": 0,
+               "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+               "chat": {"id": user_id, "type": "private"}}
+    message.update(content or {"text": "hi"})
+    return Update.de_json({"update_id": update_id, "message": message}, None)
+
+
+def video(update_id: int, user_id: int) -> Update:
+    return update(update_id, user_id, video={"file_id": f"v{update_id}", "file_unique_id": f"u{update_id}",
+                                             "width": 1, "height": 1, "duration": 1})
+
+
+def document(update_id: int, user_id: int) -> Update:
+    return update(update_id, user_id, document={"file_id": f"d{update_id}", "file_unique_id": f"u{update_id}"})
+
+
+def gate(tmp_path, **kwargs) -> AccessGate:
+    gate = AccessGate(env_file=str(tmp_path / "missing.env"), **kwargs)
+    gate.allowed = frozenset()
+    return gate
+
+
+def test_a_dump_of_videos_is_not_throttled(tmp_path):
+    async def main():
+        access = gate(tmp_path, rate=1, burst=50)
+        admitted = [access.admit(video(i, 1)) for i in range(120)]
+        admitted += [access.admit(document(i, 1)) for i in range(120, 140)]
+        # other updates are still limited, and share the bucket the videos left untouched
+        texts = [access.admit(update(i, 1)) for i in range(140, 200)]
+        await asyncio.sleep(0)
+        return access, admitted, texts
+
+    access, admitted, texts = asyncio.run(main())
+    assert all(admitted)
+    assert sum(texts) == 50
+    assert access.throttled == 10
+
+
+def test_the_allow_list_still_applies_to_videos(tmp_path):
+    access = gate(tmp_path)
+    access.allowed = frozenset({1})
+    assert access.admit(video(1, 1))
+    assert not access.admit(video(2, 2))
+    assert not access.admit(update(3, 2), throttle=False)
+    assert access.rejected == 2
@@ -0,0 +1,81 @@
+import html
+import re
+
+from captions import CAPTION_LIMIT, ELLIPSIS, STYLE_TAGS, CaptionRenderer, utf16_len
+
+TAGS = re.compile(r'</?(?:b|i|u|s|code|pre|blockquote|tg-spoiler)>|<a href="[^"]*">|</a>')
+
+
+def plain(rendered: str) -> str:
+    """The caption text Telegram counts: tags stripped, entities decoded."""
+    text = TAGS.sub("", rendered)
+    # anything left that looks like a tag was cut or came from unescaped text
+    assert "<" not in text and ">" not in text
+    return html.unescape(text)
+
+
+def assert_valid(rendered: str, renderer: CaptionRenderer):
+    assert rendered.startswith(renderer._open) and rendered.endswith(renderer._close)
+    text = plain(rendered)
+    assert utf16_len(text) <= CAPTION_LIMIT
+    # no half surrogate pair is left behind
+    text.encode("utf-8")
+    return text
+
+
+def test_short_captions_are_unchanged():
+    renderer = CaptionRenderer(prefix="@Chan", suffix="[HQ]", style="bold", mention_text="Join @chan")
+    assert renderer.render("Show S01E01 & more.mkv") == "<b>@Chan Show S01E01 &amp; more [HQ].mkv\n\nJoin @chan</b>"
+
+
+def test_long_captions_are_cut_to_the_limit_keeping_the_tail():
+    renderer = CaptionRenderer(suffix="[HQ]", mention_text="Join @chan")
+    text = assert_valid(renderer.render("x" * 2000 + ".mp4"), renderer)
+    assert utf16_len(text) == CAPTION_LIMIT
+    assert text.endswith(f"{ELLIPSIS} [HQ].mp4\n\nJoin @chan")
+
+
+def test_surrogate_pairs_at_the_cut_are_dropped_whole():
+    renderer = CaptionRenderer(suffix="[HQ]")
+    tail_len = utf16_len(" [HQ]")
+    for offset in range(4):
+        # emoji are two UTF-16 units each; shift so the cut falls on both halves
+        caption = "a" * offset + "🔥" * 1000
+        text = assert_valid(renderer.render(caption), renderer)
+        body = text[:-len(ELLIPSIS + " [HQ]")]
+        assert body == caption[:len(body)]
+        assert CAPTION_LIMIT - 1 <= utf16_len(text) <= CAPTION_LIMIT
+        assert utf16_len(body) >= CAPTION_LIMIT - tail_len - 2
+
+
+def test_markup_characters_near_the_cut_are_escaped_not_split():
+    for style in ("none", *STYLE_TAGS):
+        renderer = CaptionRenderer(style=style, suffix="<&>", link_wrap="https://t.me/x?a=1&b=2")
+        for filler in range(1010, 1025):
+            caption = "y" * filler + "<b>&amp;</b>" * 5
+            text = assert_valid(renderer.render(caption), renderer)
+            assert text.startswith("y" * min(filler, 1000))
+            assert text.endswith(" <&>")
+
+
+def test_a_tail_longer_than_the_limit_is_cut_itself():
+    renderer = CaptionRenderer(suffix="S" * 700, mention_text="M" * 700, style="italic")
+    text = assert_valid(renderer.render("Episode 1.mkv"), renderer)
+    assert utf16_len(text) == CAPTION_LIMIT
+    assert text.startswith("Episode 1 SSS") and text.endswith("M" + ELLIPSIS)
+
+    renderer = CaptionRenderer(suffix="&" * 1100)
+    text = assert_valid(renderer.render(""), renderer)
+    assert text == " " + "&" * (CAPTION_LIMIT - 2) + ELLIPSIS
+
+    # the cut falls inside an emoji of the tail
+    renderer = CaptionRenderer(mention_text="🔥" * 600)
+    text = assert_valid(renderer.render("ab"), renderer)
+    assert text == "ab\n\n" + "🔥" * 509 + ELLIPSIS
+
+
+def test_empty_captions():
+    assert CaptionRenderer().render("") == ""
+    assert CaptionRenderer(style="bold").render("   ") == ""
+    assert CaptionRenderer(prefix="@Chan", style="bold").render("") == "<b>@Chan</b>"
+    assert CaptionRenderer(mention_text="Join").render("") == "\n\nJoin"
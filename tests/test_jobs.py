@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from batching import QueuedVideo
+from jobs import FAILED, IN_FLIGHT, PENDING, SENT, SendJob, SendJobQueue, SendJobStore, job_key
+
+
+def video(message_id: int, file_unique_id: str = "vid", caption: str = "caption") -> QueuedVideo:
+    return QueuedVideo(message_id, f"file-{file_unique_id}", caption, "cover",
+                       job_key(file_unique_id, caption, "cover"))
+
+
+def job(item: QueuedVideo, destination=1) -> SendJob:
+    return SendJob(f"{item.key}:{destination}", destination, 1, 1, None, item, 0)
+
+
+def rows(store: SendJobStore):
+    return {key: (state, attempts, next_at) for key, state, attempts, next_at in store._connection().execute(
+        "SELECT job_key, state, attempts, next_attempt_at FROM send_jobs")}
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text):
+        self.messages.append((chat_id, text))
+
+
+def test_job_key_depends_on_caption_and_cover():
+    assert job_key("vid", "a", "cover") == job_key("vid", "a", "cover")
+    assert job_key("vid", "a", "cover") != job_key("vid", "b", "cover")
+    assert job_key("vid", "a", "cover") != job_key("vid", "a", "other")
+
+
+def test_add_dedupes_redeliveries_of_the_same_message(tmp_path):
+    store = SendJobStore(str(tmp_path / "jobs.sqlite3"))
+    first = job(video(10))
+    assert store.add([first]) == [None]
+    assert rows(store)[first.key] == (PENDING, 0, IN_FLIGHT)
+    assert store.add([first]) == [(PENDING, 10)]
+    # a new message while the first is still pending: sent once
+    assert store.add([job(video(11))]) == [(PENDING, 10)]
+
+    store.update([(first.key, SENT, None, 0.0, None)])
+    assert store.add([first]) == [(SENT, 10)]
+    store.close()
+
+
+def test_add_rearms_sent_jobs_for_a_new_message_and_failed_jobs(tmp_path):
+    store = SendJobStore(str(tmp_path / "jobs.sqlite3"))
+    first = job(video(10))
+    store.add([first])
+    store.update([(first.key, SENT, 2, 0.0, None)])
+    assert store.add([job(video(11))]) == [None]
+    assert rows(store)[first.key] == (PENDING, 0, IN_FLIGHT)
+
+    store.update([(first.key, FAILED, 6, 0.0, "Forbidden")])
+    assert store.add([job(video(11))]) == [None]
+    assert rows(store)[first.key] == (PENDING, 0, IN_FLIGHT)
+
+    # other destinations and settings are separate jobs
+    assert store.add([job(video(11), destination=2), job(video(11, caption="other"))]) == [None, None]
+    store.close()
+
+
+def test_enqueue_reports_videos_waiting_from_an_earlier_message(tmp_path):
+    async def main():
+        queue = SendJobQueue(str(tmp_path / "jobs.sqlite3"))
+        assert await queue.enqueue(video(10), 1, 1, None, (1, "@channel")) == ((1, "@channel"), 0)
+        assert await queue.enqueue(video(10), 1, 1, None, (1, "@channel")) == ((), 0)
+        assert await queue.enqueue(video(11), 1, 1, None, (1, "@channel", 2)) == ((2,), 2)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(main())
+    assert (queue.enqueued, queue.duplicates) == (3, 4)
+
+
+def run_results(path, results, max_attempts=6):
+    """Enqueues a two-video chunk for chat 1 and sends it, retrying as the queue would, once per result."""
+    bot = FakeBot()
+    items = [video(10, "a"), video(11, "b")]
+
+    async def main():
+        queue = SendJobQueue(str(path), max_attempts=max_attempts, retry_base=10, retry_max=40)
+        for item in items:
+            await queue.enqueue(item, 1, 1, None, (1,))
+        for attempt, error in enumerate(results):
+            if attempt:
+                await queue._dispatch(queue.store.pending_after("", 10), lambda job: None, None)
+            await queue.on_result(bot, 1, items, error)
+        await queue.stop()
+        return queue
+
+    return asyncio.run(main()), bot
+
+
+def test_transient_errors_back_off_the_whole_chunk(tmp_path):
+    started = time.time()
+    queue, bot = run_results(tmp_path / "jobs.sqlite3", [NetworkError("timed out")])
+    state = rows(queue.store)
+    assert {(s, attempts) for s, attempts, _ in state.values()} == {(PENDING, 1)}
+    next_at = {next_at for _, _, next_at in state.values()}
+    assert len(next_at) == 1
+    assert started + 5 <= next_at.pop() <= time.time() + 10
+    assert (queue.retries, queue.failed, bot.messages) == (2, 0, [])
+
+
+def test_retry_after_is_respected(tmp_path):
+    started = time.time()
+    queue, _ = run_results(tmp_path / "jobs.sqlite3", [RetryAfter(120)])
+    assert all(next_at >= started + 120 for _, _, next_at in rows(queue.store).values())
+
+
+def test_backoff_grows_and_is_capped(tmp_path):
+    queue = SendJobQueue(str(tmp_path / "jobs.sqlite3"), retry_base=10, retry_max=40)
+    for attempts, delay in [(1, 10), (2, 20), (3, 40), (8, 40)]:
+        assert delay / 2 <= queue.backoff(attempts) <= delay
+
+
+def test_delayed_jobs_that_get_through_are_reported(tmp_path):
+    _, bot = run_results(tmp_path / "jobs.sqlite3", [NetworkError("timed out")])
+
+    async def main():
+        queue = SendJobQueue(str(tmp_path / "jobs.sqlite3"))
+        resent = []
+        await queue._dispatch(queue.store.pending_after("", 10), resent.append, None)
+        assert queue.store.due(time.time() + 3600, 10) == []
+        await queue.on_result(bot, 1, [job.item for job in resent], None)
+        await queue.stop()
+        return queue, resent
+
+    queue, resent = asyncio.run(main())
+    assert len(resent) == 2
+    # attempts are kept for the record
+    assert {(s, attempts) for s, attempts, _ in rows(queue.store).values()} == {(SENT, 1)}
+    assert bot.messages == [(1, "✅ 2 delayed video(s) sent.")]
+
+
+def test_permanent_errors_and_exhausted_retries_fail(tmp_path):
+    queue, bot = run_results(tmp_path / "permanent.sqlite3", [BadRequest("Chat not found")])
+    assert {s for s, _, _ in rows(queue.store).values()} == {FAILED}
+    assert bot.messages == [(1, "❌ Couldn't send 2 video(s): Chat not found")]
+
+    queue, bot = run_results(tmp_path / "exhausted.sqlite3", [NetworkError("down")] * 3, max_attempts=3)
+    assert {(s, attempts) for s, attempts, _ in rows(queue.store).values()} == {(FAILED, 3)}
+    assert (queue.retries, queue.failed) == (4, 2)
+    assert len(bot.messages) == 1
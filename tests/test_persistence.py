@@ -0,0 +1,33 @@
+import asyncio
+import sqlite3
+
+from persistence import SQLitePersistence
+
+
+def test_flush_writes_every_queued_row(tmp_path):
+    path = str(tmp_path / "bot_data.sqlite3")
+
+    async def main():
+        persistence = SQLitePersistence(filepath=path)
+        for user_id in range(5):
+            await persistence.update_user_data(user_id, {"prefix": str(user_id)})
+        assert await persistence.written()
+        await persistence.update_user_data(9, {"prefix": "last"})
+        await persistence.flush()
+
+    asyncio.run(main())
+    assert sqlite3.connect(path).execute("SELECT count(*) FROM user_data").fetchone()[0] == 6
+
+
+def test_failing_writes_do_not_hang_written_or_flush(tmp_path):
+    async def main():
+        persistence = SQLitePersistence(filepath=str(tmp_path / "missing" / "bot_data.sqlite3"), update_interval=60)
+        await persistence.update_user_data(1, {"prefix": "x"})
+        assert not await asyncio.wait_for(persistence.written(), 5)
+        await asyncio.wait_for(persistence.flush(), 5)
+        return persistence.stats()
+
+    stats = asyncio.run(main())
+    # the failed write, then flush()'s last attempt
+    assert stats["write_failures"] == 2
+    assert stats["pending_rows"] == 0
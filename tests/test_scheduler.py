@@ -0,0 +1,122 @@
+import asyncio
+import inspect
+import random
+
+from telegram import Update
+
+from scheduler import OrderedUpdateProcessor
+
+
+def update(update_id: int, user_id: int) -> Update:
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": "hi",
+        "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+        "chat": {"id": user_id, "type": "private"}}}, None)
+
+
+def test_each_user_in_order_within_the_concurrency_bound():
+    rng = random.Random(4)
+    log = []
+    running = set()
+    peak = 0
+
+    async def handle(user_id: int, seq: int):
+        nonlocal peak
+        # one update per user at a time
+        assert user_id not in running
+        running.add(user_id)
+        peak = max(peak, len(running))
+        log.append((user_id, seq))
+        await asyncio.sleep(rng.choice((0, 0.001, 0.005, 0.02)))
+        running.discard(user_id)
+
+    async def main():
+        processor = OrderedUpdateProcessor(concurrency=3)
+        await processor.initialize()
+        tasks = []
+        for seq in range(10):
+            for user_id in range(1, 7):
+                tasks.append(asyncio.create_task(
+                    processor.process_update(update(len(tasks), user_id), handle(user_id, seq))))
+                if rng.random() < 0.3:
+                    await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return processor
+
+    processor = asyncio.run(main())
+    for user_id in range(1, 7):
+        assert [seq for user, seq in log if user == user_id] == list(range(10))
+    assert 1 < peak <= 3
+    assert processor.max_key_depth > 1
+    stats = processor.stats()
+    assert (stats["processed"], stats["in_flight"], stats["queued"], stats["active_keys"]) == (60, 0, 0, 0)
+    assert processor._tails == {}
+
+
+def test_updates_that_are_not_admitted_are_dropped_unstarted():
+    calls = []
+
+    def admit(update, throttle=True):
+        calls.append((update.effective_user.id, throttle))
+        return not throttle or update.effective_user.id != 2
+
+    async def handle(seen, user_id):
+        seen.append(user_id)
+
+    async def main():
+        processor = OrderedUpdateProcessor(concurrency=2, admit=admit)
+        await processor.initialize()
+        seen = []
+        dropped = handle(seen, 2)
+        await processor.process_update(update(1, 1), handle(seen, 1))
+        await processor.process_update(update(2, 2), dropped)
+        await processor.process_replayed(update(3, 2), handle(seen, 2))
+        return processor, seen, dropped
+
+    processor, seen, dropped = asyncio.run(main())
+    assert calls == [(1, True), (2, True), (2, False)]
+    assert seen == [1, 2]
+    assert inspect.getcoroutinestate(dropped) == inspect.CORO_CLOSED
+    assert (processor.dropped, processor.processed) == (1, 2)
+    assert processor._tails == {} and not processor._depth
+
+
+def test_cancelled_waits_are_cleaned_up_and_keep_the_order():
+    log = []
+
+    async def handle(name, release=None):
+        log.append(f"{name} start")
+        if release is not None:
+            await release.wait()
+        log.append(f"{name} end")
+
+    async def main():
+        processor = OrderedUpdateProcessor(concurrency=4)
+        await processor.initialize()
+        release = asyncio.Event()
+        first = asyncio.create_task(processor.process_update(update(1, 7), handle("first", release)))
+        second_coroutine = handle("second")
+        second = asyncio.create_task(processor.process_update(update(2, 7), second_coroutine))
+        third = asyncio.create_task(processor.process_update(update(3, 7), handle("third")))
+        await asyncio.sleep(0.01)
+        assert processor._depth[("user", 7)] == 3
+
+        # the second update is cancelled while waiting for the first
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        assert inspect.getcoroutinestate(second_coroutine) == inspect.CORO_CLOSED
+        assert processor._depth[("user", 7)] == 2
+        assert processor.queued == 1
+        # later updates still wait for the one running
+        fourth = asyncio.create_task(processor.process_update(update(4, 7), handle("fourth")))
+        await asyncio.sleep(0.01)
+        assert log == ["first start"]
+
+        release.set()
+        await asyncio.gather(first, third, fourth)
+        return processor
+
+    processor = asyncio.run(main())
+    assert log == ["first start", "first end", "third start", "third end", "fourth start", "fourth end"]
+    assert processor._tails == {} and not processor._depth
+    assert (processor.queued, processor.in_flight, processor.processed) == (0, 0, 3)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+from shards import HashRing, ShardConsumer, ShardQueue, ShardRouter, queue_path
+
+
+def message(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "from": {"id": user_id}, "chat": {"id": user_id}}}
+
+
+def queued(queue_dir, shard: int):
+    queue = ShardQueue(queue_path(queue_dir, shard))
+    rows = [json.loads(data) for _, data in queue.read(0, -1)]
+    queue.close()
+    return rows
+
+
+def test_queue_ignores_updates_already_queued(tmp_path):
+    queue = ShardQueue(str(tmp_path / "shard-0.sqlite3"))
+    queue.put_many([(1, "a"), (2, "b")])
+    queue.put_many([(2, "b again"), (3, "c")])
+    rows = queue.read(0, 10)
+    assert [data for _, data in rows] == ["a", "b", "c"]
+    queue.ack([rows[0][0]])
+    assert queue.depth() == 2
+    assert queue.last_id() == rows[-1][0]
+    queue.close()
+
+
+def route_all(queue_dir, shards: int, updates):
+    async def main():
+        router = ShardRouter(shards, str(queue_dir))
+        await router.start()
+        for update in updates:
+            await router.route(update)
+        await router.close()
+        return router.moved
+
+    return asyncio.run(main())
+
+
+def test_rebalance_moves_updates_to_their_new_shard_in_order(tmp_path):
+    updates = [message(update_id, update_id % 20) for update_id in range(1, 201)]
+    route_all(tmp_path, 1, updates)
+
+    moved = route_all(tmp_path, 3, [])
+    ring = HashRing(3)
+    assert moved == sum(1 for update in updates if ring.shard_for_update(update) != 0)
+    for shard in range(3):
+        rows = queued(tmp_path, shard)
+        assert all(ring.shard_for_update(update) == shard for update in rows)
+        for user_id in range(20):
+            ids = [update["update_id"] for update in rows if update["message"]["from"]["id"] == user_id]
+            assert ids == sorted(ids)
+    assert sum(len(queued(tmp_path, shard)) for shard in range(3)) == len(updates)
+
+
+def test_rebalance_to_fewer_shards_empties_the_removed_ones(tmp_path):
+    updates = [message(update_id, update_id % 20) for update_id in range(1, 101)]
+    route_all(tmp_path, 3, updates)
+
+    route_all(tmp_path, 2, [])
+    assert not (tmp_path / "shard-2.sqlite3").exists()
+    ring = HashRing(2)
+    rows = queued(tmp_path, 0) + queued(tmp_path, 1)
+    assert sorted(update["update_id"] for update in rows) == list(range(1, 101))
+    for shard in range(2):
+        assert all(ring.shard_for_update(update) == shard for update in queued(tmp_path, shard))
+
+
+def test_consumer_redelivers_what_a_killed_worker_did_not_finish(tmp_path):
+    queue = ShardQueue(queue_path(str(tmp_path), 0))
+    queue.put_many([(i, json.dumps(message(i, 7))) for i in range(1, 11)])
+    queue.close()
+
+    async def killed():
+        stuck = asyncio.Event()
+
+        async def process(update, replayed):
+            if update["update_id"] > 4:
+                # the worker dies while these are being processed
+                await stuck.wait()
+
+        consumer = ShardConsumer(0, process, queue_dir=str(tmp_path), poll_interval=0.01)
+        run = asyncio.create_task(consumer.run(asyncio.Event()))
+        while consumer.acked < 4:
+            await asyncio.sleep(0.01)
+        run.cancel()
+        for task in list(consumer._tasks):
+            task.cancel()
+        await asyncio.gather(run, *consumer._tasks, return_exceptions=True)
+        consumer._executor.shutdown()
+        consumer._queue.close()
+
+    asyncio.run(killed())
+
+    async def restarted():
+        seen = []
+        stop = asyncio.Event()
+
+        async def process(update, replayed):
+            seen.append((update["update_id"], replayed))
+            if update["update_id"] == 11:
+                stop.set()
+
+        consumer = ShardConsumer(0, process, queue_dir=str(tmp_path), poll_interval=0.01)
+        run = asyncio.create_task(consumer.run(stop))
+        while len(seen) < 6:
+            await asyncio.sleep(0.01)
+        # arrives after the worker started
+        ShardQueue(queue_path(str(tmp_path), 0)).put_many([(11, json.dumps(message(11, 7)))])
+        await run
+        return seen, consumer
+
+    seen, consumer = asyncio.run(restarted())
+    assert seen == [(i, True) for i in range(5, 11)] + [(11, False)]
+    assert consumer.acked == 7
+    assert queued(tmp_path, 0) == []
@@ -0,0 +1,75 @@
+import datetime
+
+from telegram import Chat, Message, MessageEntity
+
+from urls import MAX_URL_LENGTH, MAX_URLS_PER_MESSAGE, image_urls, is_image_url, scan_urls
+
+
+def message(text: str, entities=()) -> Message:
+    return Message(1, datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc), Chat(1, Chat.PRIVATE),
+                   text=text, entities=list(entities))
+
+
+def entity(text: str, part: str, kind: str = MessageEntity.URL, url: str = None) -> MessageEntity:
+    # plain ASCII in these tests, so str offsets are UTF-16 offsets
+    return MessageEntity(kind, text.index(part), len(part), url=url)
+
+
+def test_scheme_is_matched_in_any_case():
+    text = "HTTP://Example.com/A.JPG and hTTpS://x.org/b.png"
+    assert list(scan_urls(text)) == ["HTTP://Example.com/A.JPG", "hTTpS://x.org/b.png"]
+    assert image_urls(message(text)) == ["HTTP://Example.com/A.JPG", "hTTpS://x.org/b.png"]
+
+
+def test_trailing_punctuation_and_brackets_are_not_part_of_the_url():
+    text = "look: https://x.org/a.jpg). Also (https://x.org/b.png), and «http://x.org/c.webp».\n"
+    assert list(scan_urls(text)) == ["https://x.org/a.jpg", "https://x.org/b.png", "http://x.org/c.webp"]
+
+
+def test_query_and_fragment_are_ignored_for_the_extension():
+    assert is_image_url("https://x.org/a.jpeg?w=100#top")
+    assert not is_image_url("https://x.org/a.html?img=b.jpg")
+    assert not is_image_url("ftp://x.org/a.jpg")
+    assert not is_image_url("https://x.org/" + "a" * MAX_URL_LENGTH + ".jpg")
+
+
+def test_text_with_separators_but_no_url():
+    for text in ("://a.jpg", "see :// here", "ftp://x.org/a.jpg", "http://", "https:// a.jpg", "abc://x.png"):
+        assert list(scan_urls(text)) == []
+        assert image_urls(message(text)) == []
+    assert image_urls(message("no url at all.jpg")) == []
+
+
+def test_url_entities_including_bare_domains():
+    text = "pics: example.com/a.jpg and https://x.org/b.png"
+    entities = [entity(text, "example.com/a.jpg"), entity(text, "https://x.org/b.png")]
+    assert image_urls(message(text, entities)) == ["http://example.com/a.jpg", "https://x.org/b.png"]
+
+
+def test_text_link_entities_use_their_target():
+    text = "this cover and that page"
+    entities = [entity(text, "cover", MessageEntity.TEXT_LINK, "https://x.org/cover.png"),
+                entity(text, "page", MessageEntity.TEXT_LINK, "https://x.org/page.html")]
+    assert image_urls(message(text, entities)) == ["https://x.org/cover.png"]
+
+
+def test_entities_without_urls_mean_no_urls():
+    text = "https://x.org/a.jpg"
+    assert image_urls(message(text, [entity(text, "x.org", MessageEntity.BOLD)])) == []
+
+
+def test_duplicates_are_dropped_and_the_count_is_capped():
+    urls = [f"https://x.org/{i}.jpg" for i in range(MAX_URLS_PER_MESSAGE + 3)]
+    text = " ".join([urls[0], urls[1], urls[0]] + urls[2:])
+    assert image_urls(message(text)) == urls[:MAX_URLS_PER_MESSAGE]
+    entities = [MessageEntity(MessageEntity.URL, offset, len(url))
+                for offset, url in zip(_offsets(text), text.split(" "))]
+    assert image_urls(message(text, entities)) == urls[:MAX_URLS_PER_MESSAGE]
+    assert image_urls(message(text), limit=2) == urls[:2]
+
+
+def _offsets(text: str):
+    offset = 0
+    for word in text.split(" "):
+        yield offset
+        offset += len(word) + 1
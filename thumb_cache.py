@@ -0,0 +1,88 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+THUMB_CACHE_SIZE = int(os.getenv("THUMB_CACHE_SIZE", "10000"))
+THUMB_CACHE_TTL = float(os.getenv("THUMB_CACHE_TTL", str(24 * 3600)))
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class ThumbCache:
+    """Bounded LRU + TTL map of image URL / content hash -> Telegram file_id.
+
+    File ids are valid for the whole bot, so one entry serves every user who
+    pastes the same poster URL or an identical image.
+    """
+
+    def __init__(self, max_size: int = THUMB_CACHE_SIZE, ttl: float = THUMB_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            file_id, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return file_id
+            del self._entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def _put(self, key: str, file_id: str):
+        self._entries[key] = (file_id, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_by_url(self, url: str) -> Optional[str]:
+        return self._get("url:" + normalize_url(url))
+
+    def get_by_content(self, digest: str) -> Optional[str]:
+        return self._get("sha:" + digest)
+
+    def put(self, file_id: str, url: Optional[str] = None, digest: Optional[str] = None):
+        if url:
+            self._put("url:" + normalize_url(url), file_id)
+        if digest:
+            self._put("sha:" + digest, file_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
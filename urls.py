@@ -0,0 +1,77 @@
+import os
+import re
+from typing import Iterable, List
+
+from telegram import Message, MessageEntity
+
+MAX_URLS_PER_MESSAGE = int(os.getenv("MAX_URLS_PER_MESSAGE", "5"))
+MAX_URL_LENGTH = 2048
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+URL_ENTITIES = (MessageEntity.URL, MessageEntity.TEXT_LINK)
+
+# a single character class with no alternation: matches in one pass, never backtracks
+_NON_SPACE = re.compile(r"\S*")
+_TRAILING_PUNCTUATION = ".,;:!?)]}>'\"»…"
+
+
+def is_image_url(url: str) -> bool:
+    if len(url) > MAX_URL_LENGTH:
+        return False
+    scheme, sep, rest = url.partition("://")
+    if not sep or not rest or scheme.lower() not in ("http", "https"):
+        return False
+    path = rest.split("#", 1)[0].split("?", 1)[0]
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def scan_urls(text: str) -> Iterable[str]:
+    """Yields http(s) URLs in ``text``; each character is looked at a bounded number of times."""
+    start = 0
+    while True:
+        sep = text.find("://", start)
+        if sep < 0:
+            return
+        if text[max(0, sep - 5):sep].lower() == "https":
+            begin = sep - 5
+        elif text[max(0, sep - 4):sep].lower() == "http":
+            begin = sep - 4
+        else:
+            start = sep + 3
+            continue
+        end = _NON_SPACE.match(text, sep + 3).end()
+        start = end
+        url = text[begin:end].rstrip(_TRAILING_PUNCTUATION)
+        if len(url) > sep + 3 - begin:
+            yield url
+
+
+def _entity_urls(message: Message) -> Iterable[str]:
+    for entity, text in message.parse_entities(URL_ENTITIES).items():
+        url = entity.url if entity.type == MessageEntity.TEXT_LINK else text
+        # Telegram also marks bare "example.com/a.jpg" as a url entity
+        yield url if "://" in url else f"http://{url}"
+
+
+def image_urls(message: Message, limit: int = MAX_URLS_PER_MESSAGE) -> List[str]:
+    """Image URLs in a text message, in order and without duplicates.
+
+    Telegram's own ``url``/``text_link`` entities are used when present; a
+    message with entities but no URL entity has no URL. Texts without entities
+    (replayed or synthetic updates) go through :func:`scan_urls`, and anything
+    without ``://`` is rejected before scanning.
+    """
+    text = message.text or ""
+    if message.entities:
+        candidates = _entity_urls(message)
+    elif "://" in text:
+        candidates = scan_urls(text)
+    else:
+        return []
+    urls: List[str] = []
+    for url in candidates:
+        if is_image_url(url) and url not in urls:
+            urls.append(url)
+            if len(urls) >= limit:
+                break
+    return urls
@@ -0,0 +1,97 @@
+import sys
+from copy import deepcopy
+from typing import Any, Dict, Iterator, MutableMapping, Optional
+
+from captions import STYLE_TAGS
+
+# what readers fall back to (``user_data.get(key, default)``); never stored per user
+DEFAULTS: Dict[str, Any] = {
+    "caption_style": "none",
+    "prefix": "",
+    "suffix": "",
+    "mention_text": "",
+    "link_wrap": None,
+}
+
+STYLES = {style: style for style in ("none", *STYLE_TAGS)}
+
+_UNSET = object()
+
+
+class UserSettings(MutableMapping):
+    """A user's settings in slots instead of a per-user dict.
+
+    Used as ``context.user_data``, so handlers keep the mapping interface.
+    Unset fields hold a shared sentinel, and setting a field to its value in
+    ``DEFAULTS`` unsets it, so defaults cost nothing per user and aren't
+    persisted. Style names are interned, so users share one string per style.
+    Keys without a slot go to a dict created on demand.
+    """
+
+    __slots__ = ("caption_style", "prefix", "suffix", "mention_text", "link_wrap",
+                 "thumb_file_id", "destinations", "_extra")
+    FIELDS = frozenset(__slots__[:-1])
+
+    def __init__(self, *args, **kwargs):
+        for name in self.__slots__[:-1]:
+            setattr(self, name, _UNSET)
+        self._extra: Optional[dict] = None
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is _UNSET:
+                raise KeyError(key)
+            return value
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self.FIELDS:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+            return
+        if key in DEFAULTS and value == DEFAULTS[key]:
+            value = _UNSET
+        elif key == "caption_style" and isinstance(value, str):
+            value = STYLES.get(value) or sys.intern(value)
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        if key in self.FIELDS:
+            if getattr(self, key) is _UNSET:
+                raise KeyError(key)
+            setattr(self, key, _UNSET)
+            return
+        if self._extra is None:
+            raise KeyError(key)
+        del self._extra[key]
+        if not self._extra:
+            self._extra = None
+
+    def __iter__(self) -> Iterator[str]:
+        for name in self.__slots__[:-1]:
+            if getattr(self, name) is not _UNSET:
+                yield name
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self) -> int:
+        count = sum(getattr(self, name) is not _UNSET for name in self.__slots__[:-1])
+        return count + (len(self._extra) if self._extra else 0)
+
+    def __deepcopy__(self, memo: dict) -> "UserSettings":
+        # strings are immutable; only the containers need copying
+        copied = UserSettings()
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not _UNSET:
+                setattr(copied, name, deepcopy(value, memo))
+        return copied
+
+    def __repr__(self) -> str:
+        return f"UserSettings({dict(self)!r})"
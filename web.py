@@ -0,0 +1,170 @@
+import asyncio
+import hmac
+import io
+import json
+import logging
+import sys
+from typing import Awaitable, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+IDLE_TIMEOUT = 30.0
+
+
+class WebServer:
+    """Minimal asyncio HTTP/1.1 server for the bot process.
+
+    Serves the Flask routes from ``app.py`` by calling the WSGI app in-process and,
+    when ``webhook_path`` is set, accepts Telegram updates POSTed to that path and
+    hands the decoded JSON to ``on_update``.
+    """
+
+    def __init__(self, wsgi_app, host: str = "0.0.0.0", port: int = 8000,
+                 webhook_path: Optional[str] = None,
+                 on_update: Optional[Callable[[dict], Awaitable[None]]] = None,
+                 secret_token: Optional[str] = None):
+        self.wsgi_app = wsgi_app
+        self.host = host
+        self.port = port
+        self.webhook_path = webhook_path
+        self.on_update = on_update
+        self.secret_token = secret_token
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, limit=MAX_HEADER_BYTES)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    self._write(writer, 400, [("Content-Type", "text/plain")], str(e).encode(), False)
+                    break
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, response_headers, payload = await self._dispatch(method, path, query, headers, body)
+                self._write(writer, status, response_headers, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except Exception:
+            logger.exception("HTTP connection failed")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise ValueError("headers too large") from None
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise ValueError("malformed request line") from None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("body too large")
+        body = await reader.readexactly(length) if length else b""
+        path, _, query = target.partition("?")
+        return method.upper(), path, query, headers, body
+
+    async def _dispatch(self, method: str, path: str, query: str, headers: dict,
+                        body: bytes) -> Tuple[int, list, bytes]:
+        if self.webhook_path and path == self.webhook_path:
+            return await self._handle_update(method, headers, body)
+        return self._call_wsgi(method, path, query, headers, body)
+
+    async def _handle_update(self, method: str, headers: dict, body: bytes) -> Tuple[int, list, bytes]:
+        plain = [("Content-Type", "text/plain")]
+        if method != "POST":
+            return 405, plain, b"Method Not Allowed"
+        if self.secret_token and not hmac.compare_digest(
+                headers.get("x-telegram-bot-api-secret-token", ""), self.secret_token):
+            return 403, plain, b"Forbidden"
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, plain, b"Invalid JSON"
+        if not isinstance(data, dict):
+            return 400, plain, b"Invalid update"
+        try:
+            await self.on_update(data)
+        except Exception:
+            logger.exception("Failed to enqueue webhook update")
+            return 500, plain, b"Internal Server Error"
+        return 200, plain, b"OK"
+
+    def _call_wsgi(self, method: str, path: str, query: str, headers: dict,
+                   body: bytes) -> Tuple[int, list, bytes]:
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "CONTENT_TYPE": headers.get("content-type", ""),
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": False,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers.items():
+            key = "HTTP_" + name.upper().replace("-", "_")
+            if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+                environ[key] = value
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = response_headers
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            payload = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], response["headers"], payload
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, status: int, headers: list, payload: bytes, keep_alive: bool):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Unknown')}"]
+        lines += [f"{name}: {value}" for name, value in headers if name.lower() not in ("content-length", "connection")]
+        lines.append(f"Content-Length: {len(payload)}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload)
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 500: "Internal Server Error", 503: "Service Unavailable"}